@@ -0,0 +1,632 @@
+# Tests for the request building and rate limiting of GroqClient.
+
+import asyncio
+import contextlib
+import json
+from collections.abc import Callable
+from typing import override
+
+import httpx
+import openai
+import pytest
+
+from trae_agent.tools.base import (
+    Tool,
+    ToolCallArguments,
+    ToolExecResult,
+    ToolParameter,
+)
+from trae_agent.utils.config import ModelParameters
+from trae_agent.utils.groq_client import (
+    _TOOL_CACHE_SIZE,
+    GroqClient,
+    _retry_delay,
+    _retry_hint,
+)
+from trae_agent.utils.llm_basics import LLMMessage
+
+
+def make_parameters(**overrides: object) -> ModelParameters:
+    parameters: dict[str, object] = {
+        "model": "llama-3.3-70b-versatile",
+        "api_key": "test-key",
+        "max_tokens": 16,
+        "temperature": 0.5,
+        "top_p": 1.0,
+        "top_k": 0,
+        "parallel_tool_calls": False,
+        "max_retries": 1,
+    }
+    parameters.update(overrides)
+    return ModelParameters(**parameters)  # pyright: ignore[reportArgumentType]
+
+
+def agent_history(turns: int, calls: int = 3) -> list[dict[str, object]]:
+    """System and user message followed by `turns` assistant tool-call groups."""
+    history: list[dict[str, object]] = [
+        {"role": "system", "content": "You are an agent."},
+        {"role": "user", "content": "Fix the bug."},
+    ]
+    for turn in range(turns):
+        ids = [f"c{turn}{call}" for call in range(calls)]
+        history.append(
+            {
+                "role": "assistant",
+                "content": "",
+                "tool_calls": [
+                    {
+                        "id": call_id,
+                        "function": {"name": "bash", "arguments": '{"command":"ls"}'},
+                        "type": "function",
+                    }
+                    for call_id in ids
+                ],
+            }
+        )
+        history.extend(
+            {"role": "tool", "content": f"output of {call_id}", "tool_call_id": call_id}
+            for call_id in ids
+        )
+    return history
+
+
+def assert_no_orphan_tool_results(payload: list[dict[str, object]]) -> None:
+    called: set[object] = set()
+    for message in payload:
+        if message["role"] == "assistant":
+            called.update(call["id"] for call in message.get("tool_calls") or ())  # pyright: ignore[reportAttributeAccessIssue, reportUnknownVariableType]
+        elif message["role"] == "tool":
+            assert message["tool_call_id"] in called
+
+
+def make_client(history: list[dict[str, object]]) -> GroqClient:
+    client = GroqClient(make_parameters())
+    client.message_history = history  # pyright: ignore[reportAttributeAccessIssue]
+    return client
+
+
+def test_window_disabled_sends_full_history():
+    history = agent_history(4)
+    client = make_client(history)
+
+    assert client._windowed_history(make_parameters()) == history
+
+
+def test_window_reset_inside_tool_results_keeps_their_tool_call():
+    history = agent_history(4)
+    client = make_client(history)
+
+    payload = client._windowed_history(
+        make_parameters(recent_messages=3, cache_buffer=5)
+    )
+
+    assert [message["role"] for message in payload] == [
+        "system",
+        "assistant",
+        "tool",
+        "tool",
+        "tool",
+    ]
+    assert payload[1] is history[-4]
+    assert_no_orphan_tool_results(payload)
+
+
+@pytest.mark.parametrize("recent_messages", range(-1, 12))
+def test_window_never_opens_on_a_tool_result(recent_messages: int):
+    client = make_client(agent_history(4))
+
+    payload = client._windowed_history(
+        make_parameters(recent_messages=recent_messages)
+    )
+
+    assert len(payload) > 1
+    assert payload[1]["role"] != "tool"
+    assert_no_orphan_tool_results(payload)
+
+
+def test_window_of_only_system_messages_is_sent_as_is():
+    history: list[dict[str, object]] = [{"role": "system", "content": "You are an agent."}]
+    client = make_client(history)
+
+    assert client._windowed_history(make_parameters(recent_messages=0)) == history
+
+
+def test_window_grows_append_only_until_the_next_reset():
+    history = agent_history(4)
+    client = make_client(history)
+    parameters = make_parameters(recent_messages=3, cache_buffer=5)
+
+    first = client._windowed_history(parameters)
+    history.append({"role": "user", "content": "Continue."})
+    second = client._windowed_history(parameters)
+
+    assert second[: len(first)] == first
+    assert second[-1]["content"] == "Continue."
+
+
+def test_budget_disabled_sends_the_window_unchanged():
+    history = agent_history(4)
+    client = make_client(history)
+
+    # The sync path sends the history as is, without copying it every turn
+    assert client._request_messages(make_parameters()) is history
+
+
+@pytest.mark.parametrize("max_history_tokens", [0, 30])
+def test_budget_fitting_only_the_tail_keeps_its_tool_call(max_history_tokens: int):
+    history = agent_history(4)
+    client = make_client(history)
+
+    payload = client._request_messages(
+        make_parameters(max_history_tokens=max_history_tokens)
+    )
+
+    assert [message["role"] for message in payload] == [
+        "system",
+        "assistant",
+        "tool",
+        "tool",
+        "tool",
+    ]
+    assert payload[1] is history[-4]
+    assert_no_orphan_tool_results(payload)
+
+
+@pytest.mark.parametrize("max_history_tokens", range(0, 400, 10))
+def test_budget_never_sends_orphan_tool_results(max_history_tokens: int):
+    client = make_client(agent_history(4))
+
+    payload = client._request_messages(
+        make_parameters(max_history_tokens=max_history_tokens)
+    )
+
+    assert payload[0]["role"] == "system"
+    assert payload[1]["role"] != "tool"
+    assert_no_orphan_tool_results(payload)
+
+
+def test_budget_keeps_everything_that_fits():
+    history = agent_history(2)
+    client = make_client(history)
+
+    assert client._request_messages(make_parameters(max_history_tokens=10_000)) == history
+
+
+async def test_concurrent_achat_calls_take_turns_on_the_history():
+    requests: list[list[dict[str, object]]] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests.append(body["messages"])
+        last = body["messages"][-1]["content"]
+        # Give the other call a chance to interleave
+        await asyncio.sleep(0.01)
+        return httpx.Response(
+            200,
+            json={
+                "id": "completion",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": f"answer {last}"},
+                        "finish_reason": "stop",
+                    }
+                ],
+            },
+        )
+
+    client = GroqClient(make_parameters())
+    client.aclient = openai.AsyncOpenAI(
+        api_key="test-key",
+        base_url="https://api.groq.com/openai/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    parameters = make_parameters()
+
+    _ = await asyncio.gather(
+        client.achat([LLMMessage(role="user", content="A")], parameters),
+        client.achat([LLMMessage(role="user", content="B")], parameters),
+    )
+
+    assert [message["content"] for message in client.message_history] == [
+        "A",
+        "answer A",
+        "B",
+        "answer B",
+    ]
+    assert [message["content"] for message in requests[1]] == ["A", "answer A", "B"]
+
+
+def chat_completion(
+    content: str, prompt_tokens: int, completion_tokens: int
+) -> dict[str, object]:
+    return {
+        "id": "completion",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "llama-3.3-70b-versatile",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def rate_limited_client(
+    handler: Callable[[httpx.Request], httpx.Response], **overrides: object
+) -> tuple[GroqClient, ModelParameters]:
+    parameters = make_parameters(
+        requests_per_minute=60, tokens_per_minute=6000, retry_base_delay=0.0, **overrides
+    )
+    client = GroqClient(parameters)
+    client.client = openai.OpenAI(
+        api_key="test-key",
+        base_url="https://api.groq.com/openai/v1",
+        max_retries=0,
+        http_client=httpx.Client(transport=httpx.MockTransport(handler)),
+    )
+    return client, parameters
+
+
+def test_rate_limits_settle_to_the_tokens_actually_used():
+    client, parameters = rate_limited_client(
+        lambda request: httpx.Response(
+            200,
+            json=chat_completion("done", 10, 2),
+            headers={"x-ratelimit-remaining-requests": "3"},
+        )
+    )
+
+    _ = client.chat([LLMMessage(role="user", content="hi")], parameters)
+
+    assert client._token_limiter is not None
+    assert client._request_limiter is not None
+    assert client._token_limiter._tokens == pytest.approx(6000 - 12, abs=1)
+    # The requests header counts per day and must not clamp the per-minute bucket
+    assert client._request_limiter._tokens == pytest.approx(59, abs=0.1)
+
+
+def test_retries_reserve_once_and_failures_are_refunded():
+    attempts: list[int] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts.append(1)
+        return httpx.Response(503, json={"error": {"message": "unavailable"}})
+
+    client, parameters = rate_limited_client(handler, max_retries=3)
+
+    with pytest.raises(ValueError, match="after max retries"):
+        _ = client.chat([LLMMessage(role="user", content="hi")], parameters)
+
+    assert len(attempts) == 3
+    assert client._token_limiter is not None
+    assert client._request_limiter is not None
+    assert client._token_limiter._tokens == pytest.approx(6000)
+    assert client._request_limiter._tokens == pytest.approx(60)
+
+
+class EchoTool(Tool):
+    def __init__(self, name: str):
+        self._name: str = name
+        super().__init__()
+
+    @override
+    def get_name(self) -> str:
+        return self._name
+
+    @override
+    def get_description(self) -> str:
+        return f"The {self._name} tool."
+
+    @override
+    def get_parameters(self) -> list[ToolParameter]:
+        return []
+
+    @override
+    async def execute(self, arguments: ToolCallArguments) -> ToolExecResult:
+        return ToolExecResult(output="")
+
+
+def test_tool_schemas_are_reused_and_sorted_by_name():
+    client = GroqClient(make_parameters())
+    tools: list[Tool] = [EchoTool("zeta"), EchoTool("alpha")]
+
+    schemas = client._build_tool_schemas(tools)
+
+    assert schemas is client._build_tool_schemas(tools)
+    assert [schema["function"]["name"] for schema in schemas or ()] == ["alpha", "zeta"]
+
+
+def test_tool_schema_cache_is_bounded():
+    client = GroqClient(make_parameters())
+    first: list[Tool] = [EchoTool("first")]
+    _ = client._build_tool_schemas(first)
+
+    for _ in range(2 * _TOOL_CACHE_SIZE):
+        _ = client._build_tool_schemas([EchoTool("fresh")])
+
+    assert len(client._tool_cache) == _TOOL_CACHE_SIZE
+    assert (id(first[0]), "first") not in {key[0] for key in client._tool_cache}
+
+
+def api_error(
+    error_class: type[openai.APIStatusError],
+    status_code: int,
+    message: str,
+    headers: dict[str, str] | None = None,
+    code: str | None = None,
+) -> openai.APIStatusError:
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return error_class(
+        message, response=response, body={"message": message, "code": code}
+    )
+
+
+@pytest.mark.parametrize(
+    ("message", "seconds"),
+    [
+        ("Rate limit reached. Please try again in 2.5s.", 2.5),
+        ("Rate limit reached. Please try again in 250ms.", 0.25),
+        ("Rate limit reached. Please try again in 1m2.5s.", 62.5),
+        ("Rate limit reached. Please try again in 7m12.864s.", 432.864),
+    ],
+)
+def test_retry_hint_parses_groq_messages(message: str, seconds: float):
+    error = api_error(openai.RateLimitError, 429, message)
+
+    assert _retry_hint(error) == pytest.approx(seconds)
+
+
+def test_retry_hint_prefers_the_retry_after_header():
+    error = api_error(
+        openai.RateLimitError,
+        429,
+        "Please try again in 20s.",
+        headers={"retry-after": "3"},
+    )
+
+    assert _retry_hint(error) == 3.0
+
+
+def test_retry_hint_falls_back_to_the_message_on_a_bad_header():
+    error = api_error(
+        openai.RateLimitError,
+        429,
+        "Please try again in 20s.",
+        headers={"retry-after": "soon"},
+    )
+
+    assert _retry_hint(error) == 20.0
+
+
+def test_retry_hint_is_none_without_a_hint():
+    assert _retry_hint(api_error(openai.InternalServerError, 500, "oops")) is None
+
+
+def test_retry_delay_caps_server_hints():
+    error = api_error(openai.RateLimitError, 429, "Please try again in 7m12.864s.")
+
+    assert _retry_delay(error, 0, make_parameters(retry_max_delay=30.0)) == 30.0
+
+
+def test_retry_delay_backs_off_exponentially_up_to_the_cap():
+    error = api_error(openai.InternalServerError, 500, "oops")
+    parameters = make_parameters(retry_base_delay=1.0, retry_max_delay=10.0)
+
+    for attempt, floor in [(0, 1.0), (1, 2.0), (2, 4.0), (5, 10.0)]:
+        delay = _retry_delay(error, attempt, parameters)
+        assert delay is not None
+        assert floor <= delay <= floor + 1.0
+
+
+@pytest.mark.parametrize(
+    ("error_class", "status_code"),
+    [
+        (openai.AuthenticationError, 401),
+        (openai.PermissionDeniedError, 403),
+        (openai.BadRequestError, 400),
+        (openai.NotFoundError, 404),
+        (openai.UnprocessableEntityError, 422),
+    ],
+)
+def test_retry_delay_treats_client_errors_as_fatal(
+    error_class: type[openai.APIStatusError], status_code: int
+):
+    error = api_error(error_class, status_code, "rejected")
+
+    assert _retry_delay(error, 0, make_parameters()) is None
+
+
+def test_retry_delay_retries_tool_use_failed():
+    error = api_error(
+        openai.BadRequestError, 400, "Failed to call a function.", code="tool_use_failed"
+    )
+
+    assert _retry_delay(error, 0, make_parameters(retry_base_delay=0.0)) == 0.0
+
+
+def test_chat_retries_a_malformed_tool_call_and_gives_up_on_other_400s():
+    responses = [
+        httpx.Response(
+            400,
+            json={
+                "error": {
+                    "message": "Failed to call a function.",
+                    "code": "tool_use_failed",
+                }
+            },
+        ),
+        httpx.Response(200, json=chat_completion("done", 10, 2)),
+        httpx.Response(400, json={"error": {"message": "Bad model.", "code": None}}),
+    ]
+    client, parameters = rate_limited_client(
+        lambda request: responses.pop(0), max_retries=3
+    )
+
+    response = client.chat([LLMMessage(role="user", content="hi")], parameters)
+    assert response.content == "done"
+
+    with pytest.raises(ValueError, match="not retrying"):
+        _ = client.chat([LLMMessage(role="user", content="again")], parameters)
+    assert responses == []
+
+
+def stream_chunk(
+    delta: dict[str, object] | None = None,
+    finish_reason: str | None = None,
+    usage: dict[str, int] | None = None,
+) -> bytes:
+    chunk: dict[str, object] = {
+        "id": "completion",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "llama-3.3-70b-versatile",
+        "choices": []
+        if delta is None
+        else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage is not None:
+        chunk["usage"] = usage
+    return f"data: {json.dumps(chunk)}\n\n".encode()
+
+
+def tool_call_fragment(index: int, **fields: str) -> dict[str, object]:
+    function = {key: fields.pop(key) for key in ("name", "arguments") if key in fields}
+    return {"tool_calls": [{"index": index, **fields, "function": function}]}
+
+
+def streaming_client(
+    events: list[bytes], **overrides: object
+) -> tuple[GroqClient, ModelParameters]:
+    async def body():
+        for event in events:
+            # Let the consumer run between events, as on a real connection
+            await asyncio.sleep(0.01)
+            yield event
+        yield b"data: [DONE]\n\n"
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if json.loads(request.content).get("stream"):
+            return httpx.Response(
+                200, headers={"content-type": "text/event-stream"}, content=body()
+            )
+        return httpx.Response(200, json=chat_completion("done", 10, 2))
+
+    parameters = make_parameters(**overrides)
+    client = GroqClient(parameters)
+    client.aclient = openai.AsyncOpenAI(
+        api_key="test-key",
+        base_url="https://api.groq.com/openai/v1",
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    return client, parameters
+
+
+TEXT_EVENTS = [
+    stream_chunk({"role": "assistant", "content": "Hel"}),
+    stream_chunk({"content": "lo"}),
+    stream_chunk({}, finish_reason="stop"),
+    stream_chunk(
+        usage={"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}
+    ),
+]
+
+
+async def test_stream_assembles_tool_calls_by_index():
+    client, parameters = streaming_client(
+        [
+            stream_chunk({"role": "assistant", "content": "Let me look"}),
+            stream_chunk(tool_call_fragment(1, id="call_b", name="view")),
+            stream_chunk(tool_call_fragment(0, id="call_a", name="bash")),
+            stream_chunk(tool_call_fragment(1, arguments='{"path": ')),
+            stream_chunk(tool_call_fragment(0, arguments='{"command": "ls"}')),
+            stream_chunk(tool_call_fragment(1, arguments='"/tmp"}')),
+            stream_chunk({}, finish_reason="tool_calls"),
+            # With include_usage the usage arrives in a last chunk without choices
+            stream_chunk(
+                usage={"prompt_tokens": 10, "completion_tokens": 7, "total_tokens": 17}
+            ),
+        ]
+    )
+
+    responses = [
+        response
+        async for response in client.achat_stream(
+            [LLMMessage(role="user", content="hi")], parameters
+        )
+    ]
+
+    assert [response.content for response in responses] == ["Let me look"] * 2
+    final = responses[-1]
+    assert final.finish_reason == "tool_calls"
+    assert final.usage is not None
+    assert (final.usage.input_tokens, final.usage.output_tokens) == (10, 7)
+    assert final.tool_calls is not None
+    assert [(call.call_id, call.name, call.arguments) for call in final.tool_calls] == [
+        ("call_a", "bash", {"command": "ls"}),
+        ("call_b", "view", {"path": "/tmp"}),
+    ]
+    assert [message["role"] for message in client.message_history] == [
+        "user",
+        "assistant",
+    ]
+
+
+async def test_closing_a_stream_early_restores_the_history_and_refunds():
+    client, parameters = streaming_client(
+        TEXT_EVENTS, requests_per_minute=60, tokens_per_minute=6000
+    )
+    client.message_history = [
+        {"role": "user", "content": "earlier"},
+        {"role": "assistant", "content": "reply"},
+    ]
+
+    stream = client.achat_stream([LLMMessage(role="user", content="hi")], parameters)
+    async with contextlib.aclosing(stream):
+        async for response in stream:
+            assert response.content == "Hel"
+            break
+
+    assert [message["content"] for message in client.message_history] == [
+        "earlier",
+        "reply",
+    ]
+    assert client._token_limiter is not None
+    assert client._request_limiter is not None
+    assert client._token_limiter._tokens == pytest.approx(6000, abs=1)
+    assert client._request_limiter._tokens == pytest.approx(60, abs=0.1)
+
+
+async def test_an_abandoned_stream_does_not_block_the_next_achat():
+    client, parameters = streaming_client(TEXT_EVENTS)
+
+    stream = client.achat_stream([LLMMessage(role="user", content="A")], parameters)
+    first = await anext(stream)
+    assert first.content == "Hel"
+
+    # The stream is still referenced but never read again or closed
+    response = await asyncio.wait_for(
+        client.achat([LLMMessage(role="user", content="B")], parameters), timeout=5
+    )
+
+    assert response.content == "done"
+    assert [message["content"] for message in client.message_history] == [
+        "A",
+        "Hello",
+        "B",
+        "done",
+    ]
+    await stream.aclose()
@@ -0,0 +1,180 @@
+# Tests for how TextEditorTool writes and lists files.
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from trae_agent.tools.base import ToolCall, ToolExecutor
+from trae_agent.tools.edit_tool import TextEditorTool
+
+
+@pytest.fixture
+def target(tmp_path: Path) -> Path:
+    path = tmp_path / "target.txt"
+    _ = path.write_text("first\nsecond\n", encoding="utf-8")
+    return path
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="symlinks need extra privileges")
+async def test_insert_through_symlink_edits_the_target(tmp_path: Path, target: Path):
+    link = tmp_path / "link.txt"
+    link.symlink_to(target)
+
+    result = await TextEditorTool().execute(
+        {"command": "insert", "path": str(link), "insert_line": 1, "new_str": "added"}
+    )
+
+    assert result.error is None
+    assert link.is_symlink()
+    assert target.read_text(encoding="utf-8") == "first\nadded\nsecond\n"
+
+
+async def test_insert_keeps_hard_links_and_mode(tmp_path: Path, target: Path):
+    hard_link = tmp_path / "hard.txt"
+    os.link(target, hard_link)
+    target.chmod(0o640)
+
+    result = await TextEditorTool().execute(
+        {"command": "insert", "path": str(target), "insert_line": 2, "new_str": "added"}
+    )
+
+    assert result.error is None
+    assert hard_link.read_text(encoding="utf-8") == "first\nsecond\nadded\n"
+    assert os.path.samefile(target, hard_link)
+    if sys.platform != "win32":
+        assert target.stat().st_mode & 0o777 == 0o640
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32" or os.geteuid() == 0,
+    reason="needs POSIX permissions that apply to the current user",
+)
+async def test_view_of_unreadable_directory_reports_an_error(tmp_path: Path):
+    directory = tmp_path / "locked"
+    directory.mkdir()
+    directory.chmod(0)
+    try:
+        result = await TextEditorTool().execute(
+            {"command": "view", "path": str(directory)}
+        )
+    finally:
+        directory.chmod(0o755)
+
+    assert result.error_code == 1
+    assert result.error
+
+
+async def test_view_lists_two_levels_without_hidden_entries(tmp_path: Path):
+    (tmp_path / "pkg" / "sub" / "deep").mkdir(parents=True)
+    _ = (tmp_path / "pkg" / "module.py").write_text("", encoding="utf-8")
+    _ = (tmp_path / ".hidden").write_text("", encoding="utf-8")
+
+    result = await TextEditorTool().execute({"command": "view", "path": str(tmp_path)})
+
+    assert result.error_code == 0
+    listing = (result.output or "").splitlines()[1:]
+    assert sorted(listing) == ["pkg/", "pkg/module.py", "pkg/sub/"]
+
+
+async def test_parallel_edits_to_one_file_all_land(tmp_path: Path):
+    path = tmp_path / "settings.py"
+    _ = path.write_text("alpha = 1\nbeta = 2\n", encoding="utf-8")
+    tool = TextEditorTool()
+    replacements = [("alpha = 1", "alpha = 10"), ("beta = 2", "beta = 20")]
+
+    results = await ToolExecutor([tool]).parallel_tool_call(
+        [
+            ToolCall(
+                name=tool.name,
+                call_id=f"call{i}",
+                arguments={
+                    "command": "str_replace",
+                    "path": str(path),
+                    "old_str": old_str,
+                    "new_str": new_str,
+                },
+            )
+            for i, (old_str, new_str) in enumerate(replacements)
+        ]
+        + [
+            ToolCall(
+                name=tool.name,
+                call_id="call_insert",
+                arguments={
+                    "command": "insert",
+                    "path": str(path),
+                    "insert_line": 0,
+                    "new_str": "# settings",
+                },
+            )
+        ]
+    )
+
+    assert all(result.success for result in results)
+    assert path.read_text(encoding="utf-8") == "# settings\nalpha = 10\nbeta = 20\n"
+
+
+def expected_insert(content: str, insert_line: int, new_str: str) -> str:
+    """Insert new_str by splitting the decoded text, keeping the file's line endings."""
+    eol = "\r\n" if "\r\n" in content else "\n"
+    lines = content.replace("\r\n", "\n").split("\n")
+    lines[insert_line:insert_line] = new_str.split("\n")
+    return eol.join(lines)
+
+
+# Empty, without a trailing newline, with one, and the same with CRLF endings
+INSERT_CONTENTS = [
+    "",
+    "only",
+    "first\nsecond",
+    "first\nsecond\n",
+    "first\r\nsecond\r\n",
+    "first\r\nsecond",
+]
+
+
+@pytest.mark.parametrize("content", INSERT_CONTENTS)
+async def test_insert_at_every_line_matches_splitting_the_text(
+    tmp_path: Path, content: str
+):
+    path = tmp_path / "target.txt"
+    tool = TextEditorTool()
+    n_lines = content.count("\n") + 1
+
+    for insert_line in range(n_lines + 1):
+        _ = path.write_bytes(content.encode("utf-8"))
+
+        result = await tool.execute(
+            {
+                "command": "insert",
+                "path": str(path),
+                "insert_line": insert_line,
+                "new_str": "new\nlines",
+            }
+        )
+
+        assert result.error is None, insert_line
+        expected = expected_insert(content, insert_line, "new\nlines")
+        assert path.read_bytes().decode("utf-8") == expected, insert_line
+
+
+@pytest.mark.parametrize("content", INSERT_CONTENTS)
+async def test_insert_past_the_last_line_is_rejected(tmp_path: Path, content: str):
+    path = tmp_path / "target.txt"
+    _ = path.write_bytes(content.encode("utf-8"))
+    n_lines = content.count("\n") + 1
+
+    result = await TextEditorTool().execute(
+        {
+            "command": "insert",
+            "path": str(path),
+            "insert_line": n_lines + 1,
+            "new_str": "new",
+        }
+    )
+
+    assert result.error is not None
+    assert f"Invalid `insert_line` parameter: {n_lines + 1}" in result.error
+    assert path.read_bytes() == content.encode("utf-8")
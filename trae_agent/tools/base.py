@@ -42,7 +42,7 @@ ToolCallArguments = dict[
 ]
 
 
-@dataclass
+@dataclass(slots=True)
 class ToolCall:
     """Represents a parsed tool call."""
 
@@ -9,11 +9,18 @@
 #
 # This modified file is released under the same license.
 
+import asyncio
+import io
+import logging
+import os
+import re
+import weakref
+from collections.abc import Awaitable, Callable, Iterable
 from pathlib import Path
 from typing import override
 
 from .base import Tool, ToolError, ToolExecResult, ToolParameter, ToolCallArguments
-from .run import maybe_truncate, run
+from .run import maybe_truncate
 
 EditToolSubCommands = [
     "view",
@@ -22,18 +29,128 @@ EditToolSubCommands = [
     "insert",
 ]
 SNIPPET_LINES: int = 4
+PATH_CACHE_SIZE: int = 128
+
+log = logging.getLogger(__name__)
+
+_IS_NT: bool = os.name == 'nt'
+_SEP: str = os.sep
+# Translation table normalising both '/' and '\\' to os.sep in a single pass
+_SEP_TRANS = str.maketrans({'/': _SEP, '\\': _SEP})
+
+# Git Bash style absolute path such as /c/Users/..., capturing the drive letter and the rest
+_GITBASH_RE = re.compile(r'^[/\\]([A-Za-z])[/\\](.*)$', re.DOTALL)
+
+# Pattern to match emojis and other characters that cause encoding issues on Windows
+_EMOJI_RE = re.compile("["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F700-\U0001F77F"  # alchemical symbols
+    "\U0001F780-\U0001F7FF"  # Geometric Shapes
+    "\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
+    "\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
+    "\U0001FA00-\U0001FA6F"  # Chess Symbols
+    "\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
+    "\U00002702-\U000027B0"  # Dingbats
+    "]+", flags=re.UNICODE)
+
+
+def _find_occurrences(content: str, needle: str) -> list[tuple[int, int]]:
+    """Return the (offset, 0-based line) of every non-overlapping match of needle in content."""
+    occurrences: list[tuple[int, int]] = []
+    line = 0
+    last_pos = 0
+    pos = content.find(needle)
+    while pos != -1:
+        line += content.count("\n", last_pos, pos)
+        occurrences.append((pos, line))
+        last_pos = pos
+        pos = content.find(needle, pos + len(needle))
+    return occurrences
+
+
+def _trace(trace: list[str] | None, msg: str, *args: object) -> None:
+    """Append a formatted debug line to trace, or do nothing when debug logging is disabled."""
+    if trace is not None:
+        trace.append(msg % args)
+
+
+def _expandtabs(text: str) -> str:
+    """Expand tabs, skipping the per-character pass entirely for text without any."""
+    return text.expandtabs() if "\t" in text else text
+
+
+def _skip_lines(content: bytes, start: int, count: int) -> int:
+    """Return the offset just past the `count`-th newline from start, or len(content) if there are fewer."""
+    pos = start
+    for _ in range(count):
+        newline = content.find(b"\n", pos)
+        if newline == -1:
+            return len(content)
+        pos = newline + 1
+    return pos
+
+
+def _lines_back(content: bytes, end: int, count: int) -> int:
+    """Return the offset of the line `count` lines before the line starting at end."""
+    pos = end
+    for _ in range(count):
+        if pos == 0:
+            break
+        pos = content.rfind(b"\n", 0, pos - 1) + 1
+    return pos
+
+
+def _decode_lines(content: bytes) -> str:
+    """Decode a slice of raw file content the way read_file does, normalising CRLF line endings."""
+    return content.decode('utf-8', errors='replace').replace("\r\n", "\n")
+
+
+def _write_chunks(path: Path, chunks: Iterable[bytes | memoryview]) -> None:
+    """Overwrite path in place with chunks, like _write_text does for str_replace and create.
+
+    Writing through the existing file keeps symlinks, hard links, ownership and
+    permissions intact, and works on Windows while another process has the file open.
+    """
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            _ = f.write(chunk)
+
+
+def _list_directory(top: str) -> list[str]:
+    """List the non-hidden files and directories up to 2 levels below top, relative to it."""
+    def raise_for_top(error: OSError) -> None:
+        # An unreadable top directory is an error; unreadable subdirectories are skipped
+        if error.filename == top:
+            raise error
+
+    entries: list[str] = []
+    for root, dirs, files in os.walk(top, onerror=raise_for_top):
+        prefix = "" if root == top else f"{os.path.basename(root)}/"
+        # Prune hidden directories in place so the walk never enters them
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        entries.extend(f"{prefix}{d}/" for d in dirs)
+        entries.extend(f"{prefix}{f}" for f in files if not f.startswith('.'))
+        if prefix:
+            # Second level reached; do not walk any deeper
+            dirs[:] = []
+    return entries
+
+
+def _write_text(path: Path, text: str) -> None:
+    """Write text to path, creating the parent directory only if the first attempt reports it missing."""
+    try:
+        _ = path.write_text(text, encoding='utf-8')
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _ = path.write_text(text, encoding='utf-8')
 
 
 class TextEditorTool(Tool):
     """Tool to replace a string in a file."""
 
-    @override
-    def get_name(self) -> str:
-        return "str_replace_based_edit_tool"
-
-    @override
-    def get_description(self) -> str:
-        return """Custom editing tool for viewing, creating and editing files
+    _DESCRIPTION: str = """Custom editing tool for viewing, creating and editing files
 * State is persistent across command calls and discussions with the user
 * If `path` is a file, `view` displays the result of applying `cat -n`. If `path` is a directory, `view` lists non-hidden files and directories up to 2 levels deep
 * The `create` command cannot be used if the specified `path` already exists as a file !!! If you know that the `path` already exists, please remove it first and then perform the `create` operation!
@@ -45,55 +162,75 @@ Notes for using the `str_replace` command:
 * The `new_str` parameter should contain the edited lines that should replace the `old_str`
 """
 
+    _PARAMETERS: list[ToolParameter] = [
+        ToolParameter(
+            name="command",
+            type="string",
+            description=f"The commands to run. Allowed options are: {', '.join(EditToolSubCommands)}.",
+            required=True,
+            enum=EditToolSubCommands,
+        ),
+        ToolParameter(
+            name="path",
+            type="string",
+            description="Absolute path to file or directory, e.g. `/repo/file.py` or `/repo`.",
+            required=True,
+        ),
+        ToolParameter(
+            name="file_text",
+            type="string",
+            description="Required parameter of `create` command, with the content of the file to be created.",
+            required=False,
+        ),
+        ToolParameter(
+            name="insert_line",
+            type="integer",
+            description="Required parameter of `insert` command. The `new_str` will be inserted AFTER the line `insert_line` of `path`.",
+            required=False,
+        ),
+        ToolParameter(
+            name="new_str",
+            type="string",
+            description="Optional parameter of `str_replace` command containing the new string (if not given, no string will be added). Required parameter of `insert` command containing the string to insert.",
+            required=False,
+        ),
+        ToolParameter(
+            name="old_str",
+            type="string",
+            description="Required parameter of `str_replace` command containing the string in `path` to replace.",
+            required=False,
+        ),
+        ToolParameter(
+            name="view_range",
+            type="array",
+            description="Optional parameter of `view` command when `path` points to a file. If none is given, the full file is shown. If provided, the file will be shown in the indicated line number range, e.g. [11, 12] will show lines 11 and 12. Indexing at 1 to start. Setting `[start_line, -1]` shows all lines from `start_line` to the end of the file.",
+            items={"type": "integer"},
+            required=False,
+        ),
+    ]
+
+    def __init__(self):
+        # Validated paths keyed by (command, input path, working directory)
+        self._path_cache: dict[tuple[str, str, str], Path] = {}
+        # Locks by real file path, held across each read-modify-write so parallel tool
+        # calls on the same file do not lose edits; a lock is dropped once unused
+        self._file_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+        super().__init__()
+
+    @override
+    def get_name(self) -> str:
+        return "str_replace_based_edit_tool"
+
+    @override
+    def get_description(self) -> str:
+        return self._DESCRIPTION
+
     @override
     def get_parameters(self) -> list[ToolParameter]:
         """Get the parameters for the str_replace_based_edit_tool."""
-        return [
-            ToolParameter(
-                name="command",
-                type="string",
-                description=f"The commands to run. Allowed options are: {', '.join(EditToolSubCommands)}.",
-                required=True,
-                enum=EditToolSubCommands,
-            ),
-            ToolParameter(
-                name="path",
-                type="string",
-                description="Absolute path to file or directory, e.g. `/repo/file.py` or `/repo`.",
-                required=True,
-            ),
-            ToolParameter(
-                name="file_text",
-                type="string",
-                description="Required parameter of `create` command, with the content of the file to be created.",
-                required=False,
-            ),
-            ToolParameter(
-                name="insert_line",
-                type="integer",
-                description="Required parameter of `insert` command. The `new_str` will be inserted AFTER the line `insert_line` of `path`.",
-                required=False,
-            ),
-            ToolParameter(
-                name="new_str",
-                type="string",
-                description="Optional parameter of `str_replace` command containing the new string (if not given, no string will be added). Required parameter of `insert` command containing the string to insert.",
-                required=False,
-            ),
-            ToolParameter(
-                name="old_str",
-                type="string",
-                description="Required parameter of `str_replace` command containing the string in `path` to replace.",
-                required=False,
-            ),
-            ToolParameter(
-                name="view_range",
-                type="array",
-                description="Optional parameter of `view` command when `path` points to a file. If none is given, the full file is shown. If provided, the file will be shown in the indicated line number range, e.g. [11, 12] will show lines 11 and 12. Indexing at 1 to start. Setting `[start_line, -1]` shows all lines from `start_line` to the end of the file.",
-                items={"type": "integer"},
-                required=False,
-            ),
-        ]
+        return self._PARAMETERS
 
     @override
     async def execute(self, arguments: ToolCallArguments) -> ToolExecResult:
@@ -109,168 +246,209 @@ Notes for using the `str_replace` command:
             return ToolExecResult(
                 error=f"No path provided for the {self.get_name()} tool", error_code=-1
             )
-        _path = Path(path)
+        if command not in self._HANDLERS:
+            return ToolExecResult(
+                error=f"Unrecognized command {command}. The allowed commands for the {self.name} tool are: {', '.join(EditToolSubCommands)}",
+                error_code=-1,
+            )
+        handler, required = self._HANDLERS[command]
         
         # Handle path conversion and validation
         try:
-            validated_path = self.validate_and_convert_path(command, _path)
+            validated_path = self.validate_and_convert_path(command, Path(path))
         except ToolError as e:
             return ToolExecResult(error=str(e), error_code=-1)
 
-        try:
-            if command == "view":
-                view_range = arguments.get("view_range", None)
-                return await self.view(validated_path, view_range)  # pyright: ignore[reportArgumentType]
-            elif command == "create":
-                file_text = arguments.get("file_text", None)
-                if file_text is None:
-                    return ToolExecResult(
-                        error="Parameter `file_text` is required for command: create",
-                        error_code=-1,
-                    )
-                self.write_file(validated_path, file_text)  # pyright: ignore[reportArgumentType]
-                return ToolExecResult(output=f"File created successfully at: {validated_path}")
-            elif command == "str_replace":
-                old_str = arguments.get("old_str") if "old_str" in arguments else None
-                if old_str is None:
-                    return ToolExecResult(
-                        error="Parameter `old_str` is required for command: str_replace",
-                        error_code=-1,
-                    )
-                new_str = arguments.get("new_str") if "new_str" in arguments else None
-                return self.str_replace(validated_path, old_str, new_str)  # pyright: ignore[reportArgumentType]
-            elif command == "insert":
-                insert_line = (
-                    arguments.get("insert_line") if "insert_line" in arguments else None
-                )
-                if insert_line is None:
-                    return ToolExecResult(
-                        error="Parameter `insert_line` is required for command: insert",
-                        error_code=-1,
-                    )
-                new_str_to_insert = (
-                    arguments.get("new_str") if "new_str" in arguments else None
-                )
-                if new_str_to_insert is None:
-                    return ToolExecResult(
-                        error="Parameter `new_str` is required for command: insert",
-                        error_code=-1,
-                    )
-                return self.insert(validated_path, insert_line, new_str_to_insert)  # pyright: ignore[reportArgumentType]
-            else:
+        for name in required:
+            if arguments.get(name) is None:
                 return ToolExecResult(
-                    error=f"Unrecognized command {command}. The allowed commands for the {self.name} tool are: {', '.join(EditToolSubCommands)}",
+                    error=f"Parameter `{name}` is required for command: {command}",
                     error_code=-1,
                 )
+
+        try:
+            return await handler(self, validated_path, arguments)
         except ToolError as e:
             return ToolExecResult(error=str(e), error_code=-1)
 
+    async def _do_view(self, path: Path, arguments: ToolCallArguments) -> ToolExecResult:
+        view_range = arguments.get("view_range", None)
+        return await self.view(path, view_range)  # pyright: ignore[reportArgumentType]
+
+    async def _do_create(self, path: Path, arguments: ToolCallArguments) -> ToolExecResult:
+        async with self._file_lock(path):
+            await self.write_file(path, arguments["file_text"])  # pyright: ignore[reportArgumentType]
+        # A new file can change which candidate an earlier path resolution would pick
+        self._path_cache.clear()
+        return ToolExecResult(output=f"File created successfully at: {path}")
+
+    async def _do_str_replace(self, path: Path, arguments: ToolCallArguments) -> ToolExecResult:
+        async with self._file_lock(path):
+            return await self.str_replace(path, arguments["old_str"], arguments.get("new_str"))  # pyright: ignore[reportArgumentType]
+
+    async def _do_insert(self, path: Path, arguments: ToolCallArguments) -> ToolExecResult:
+        async with self._file_lock(path):
+            return await self.insert(path, arguments["insert_line"], arguments["new_str"])  # pyright: ignore[reportArgumentType]
+
+    def _file_lock(self, path: Path) -> asyncio.Lock:
+        """Return the lock serialising edits to the file at path, wherever it links to."""
+        key = os.path.normcase(os.path.realpath(path))
+        lock = self._file_locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._file_locks[key] = lock
+        return lock
+
+    # Handler and required arguments for each sub-command
+    _HANDLERS: dict[
+        str,
+        tuple[
+            Callable[["TextEditorTool", Path, ToolCallArguments], Awaitable[ToolExecResult]],
+            tuple[str, ...],
+        ],
+    ] = {
+        "view": (_do_view, ()),
+        "create": (_do_create, ("file_text",)),
+        "str_replace": (_do_str_replace, ("old_str",)),
+        "insert": (_do_insert, ("insert_line", "new_str")),
+    }
+
     def validate_and_convert_path(self, command: str, path: Path) -> Path:
         """Validate the path for the str_replace_editor tool and return the corrected path."""
-        import os
-        import sys
-        
-        # Convert path to string for easier processing
         path_str = str(path)
-        
-        # Print debug info
-        print(f"Original input path: {path_str}", file=sys.stderr)
-        print(f"Working directory: {os.getcwd()}", file=sys.stderr)
+        cwd = os.getcwd()
+
+        # Reuse an earlier resolution as long as the resolved path is still there
+        key = (command, path_str, cwd)
+        cached_path = self._path_cache.get(key)
+        if cached_path is not None:
+            if os.path.exists(cached_path):
+                return cached_path
+            del self._path_cache[key]
+
+        # Collect the debug trace and emit it as a single record once the path is resolved
+        trace: list[str] | None = [] if log.isEnabledFor(logging.DEBUG) else None
+        try:
+            final_path = self._resolve_path(command, path_str, cwd, trace)
+        finally:
+            if trace:
+                log.debug("\n".join(trace))
+
+        # `create` must see the path missing, so its result is never reused
+        if command != "create":
+            if len(self._path_cache) >= PATH_CACHE_SIZE:
+                del self._path_cache[next(iter(self._path_cache))]
+            self._path_cache[key] = final_path
+        return final_path
+
+    def _resolve_path(
+        self, command: str, path_str: str, cwd: str, trace: list[str] | None
+    ) -> Path:
+        """Resolve and check the path for validate_and_convert_path, appending debug lines to trace."""
+        # Work on the string form throughout and only build a Path for the result
+        _trace(trace, "Original input path: %s", path_str)
+        _trace(trace, "Working directory: %s", cwd)
+
+        # Fast path: an existing absolute path needs no conversion, only the directory rules
+        git_bash_candidate = _IS_NT and path_str[:1] in ('/', '\\')
+        if not git_bash_candidate and os.path.isabs(path_str) and os.path.exists(path_str):
+            _trace(trace, "Using existing absolute path: %s", path_str)
+            return self._check_dir_rules(command, path_str)
         
         # Handle Git Bash style paths on Windows
-        if os.name == 'nt' and (path_str.startswith('/') or path_str.startswith('\\')):
+        if git_bash_candidate:
             # Remove leading slash for path processing
-            clean_path = path_str[1:] if path_str.startswith('/') or path_str.startswith('\\') else path_str
+            clean_path = path_str[1:]
             
             # Check if it's a Git Bash style path like /c/Users/...
-            if len(clean_path) >= 2 and clean_path[0].isalpha() and (clean_path[1] == '/' or clean_path[1] == '\\'):
+            git_bash_match = _GITBASH_RE.match(path_str)
+            if git_bash_match:
                 # Convert /c/Users/... to C:/Users/...
-                drive_letter = clean_path[0].upper()
-                # Get the rest of the path without the drive letter part
-                if clean_path[1] == '/':
-                    rest_of_path = clean_path[2:].replace('/', os.sep)
-                else:
-                    rest_of_path = clean_path[2:].replace('\\', os.sep)
+                drive_letter = git_bash_match.group(1).upper()
+                rest_of_path = git_bash_match.group(2).translate(_SEP_TRANS)
                 
                 # Create the Windows-style path
-                windows_path = f"{drive_letter}:{os.sep}{rest_of_path}"
-                final_path = Path(windows_path)
-                print(f"Converted Git Bash style path to: {final_path}", file=sys.stderr)
+                final_str = f"{drive_letter}:{_SEP}{rest_of_path}"
+                _trace(trace, "Converted Git Bash style path to: %s", final_str)
                 
                 # Check if this path exists
-                if not final_path.exists() and command != "create":
+                if command != "create" and not os.path.exists(final_str):
                     # Try the path as-is from current directory
-                    alt_path = Path(os.path.join(os.getcwd(), clean_path.replace('/', os.sep).replace('\\', os.sep)))
-                    if alt_path.exists():
-                        final_path = alt_path
-                        print(f"Using alternative path: {final_path}", file=sys.stderr)
+                    alt_str = os.path.join(cwd, clean_path.translate(_SEP_TRANS))
+                    if os.path.exists(alt_str):
+                        final_str = alt_str
+                        _trace(trace, "Using alternative path: %s", final_str)
             else:
                 # It's a relative path with Unix separators
                 # Convert to Windows path by joining with current directory
-                unix_path = clean_path.replace('/', os.sep).replace('\\', os.sep)
-                final_path = Path(os.getcwd()) / unix_path
-                print(f"Converted relative Unix path to: {final_path}", file=sys.stderr)
-        elif not path.is_absolute():
+                unix_path = clean_path.translate(_SEP_TRANS)
+                final_str = os.path.join(cwd, unix_path)
+                _trace(trace, "Converted relative Unix path to: %s", final_str)
+        elif not os.path.isabs(path_str):
             # Standard relative path
-            final_path = Path.cwd() / path
-            print(f"Converted relative path to: {final_path}", file=sys.stderr)
+            final_str = os.path.join(cwd, path_str)
+            _trace(trace, "Converted relative path to: %s", final_str)
         else:
             # Path is already absolute
-            final_path = path
-            print(f"Using absolute path: {final_path}", file=sys.stderr)
+            final_str = path_str
+            _trace(trace, "Using absolute path: %s", final_str)
         
         # For create command, we allow non-existent paths but parent directory must exist or be created
         if command == "create":
             # If the file already exists and we're trying to create it, return an error
-            if final_path.exists() and final_path.is_file():
-                raise ToolError(f"File already exists at: {final_path}. Cannot overwrite files using command `create`.")
+            if os.path.isfile(final_str):
+                raise ToolError(f"File already exists at: {final_str}. Cannot overwrite files using command `create`.")
                 
             # If the path exists but is a directory, return an error
-            if final_path.exists() and final_path.is_dir():
-                raise ToolError(f"Path {final_path} is a directory. Cannot create a file with the same name.")
+            if os.path.isdir(final_str):
+                raise ToolError(f"Path {final_str} is a directory. Cannot create a file with the same name.")
                 
             # Ensure parent directory exists
+            parent_str = os.path.dirname(final_str)
             try:
-                if not final_path.parent.exists():
-                    final_path.parent.mkdir(parents=True, exist_ok=True)
-                    print(f"Created parent directory: {final_path.parent}", file=sys.stderr)
+                if not os.path.exists(parent_str):
+                    os.makedirs(parent_str, exist_ok=True)
+                    _trace(trace, "Created parent directory: %s", parent_str)
             except Exception as e:
-                raise ToolError(f"Failed to create parent directory for {final_path}: {e}")
+                raise ToolError(f"Failed to create parent directory for {final_str}: {e}")
                 
-            return final_path
+            return Path(final_str)
         
         # For all other commands, verify the path exists
-        if not final_path.exists():
-            if os.path.exists(str(final_path)):
-                # Path exists according to os.path but not Path.exists()
-                print(f"Path exists according to os.path but not Path.exists(): {final_path}", file=sys.stderr)
-                # Use string path instead
-                final_path = Path(os.path.normpath(str(final_path)))
+        if not os.path.exists(final_str):
+            # Try some alternative paths as a last resort
+            alt_str1 = os.path.normpath(os.path.join("c:", path_str))
+            alt_str2 = os.path.normpath(os.path.join("c:", path_str[1:] if path_str.startswith('/') else path_str))
+            
+            if trace is not None:
+                trace.append("Trying alternative paths:")
+                _trace(trace, "  Alt1: %s (exists: %s)", alt_str1, os.path.exists(alt_str1))
+                _trace(trace, "  Alt2: %s (exists: %s)", alt_str2, os.path.exists(alt_str2))
+            
+            if os.path.exists(alt_str1):
+                final_str = alt_str1
+                _trace(trace, "Using alternative path 1: %s", final_str)
+            elif os.path.exists(alt_str2):
+                final_str = alt_str2
+                _trace(trace, "Using alternative path 2: %s", final_str)
             else:
-                # Try some alternative paths as a last resort
-                alt_path1 = Path(os.path.normpath(os.path.join("c:", path_str)))
-                alt_path2 = Path(os.path.normpath(os.path.join("c:", path_str[1:] if path_str.startswith('/') else path_str)))
-                
-                print(f"Trying alternative paths:", file=sys.stderr)
-                print(f"  Alt1: {alt_path1} (exists: {alt_path1.exists()})", file=sys.stderr)
-                print(f"  Alt2: {alt_path2} (exists: {alt_path2.exists()})", file=sys.stderr)
-                
-                if alt_path1.exists():
-                    final_path = alt_path1
-                    print(f"Using alternative path 1: {final_path}", file=sys.stderr)
-                elif alt_path2.exists():
-                    final_path = alt_path2
-                    print(f"Using alternative path 2: {final_path}", file=sys.stderr)
-                else:
-                    # If we still can't find a valid path, raise an error
-                    raise ToolError(f"The path {final_path} does not exist. Please provide a valid path.")
+                # If we still can't find a valid path, raise an error
+                raise ToolError(f"The path {final_str} does not exist. Please provide a valid path.")
         
-        # Check if the path points to a directory for non-view commands
-        if final_path.is_dir() and command != "view":
-            raise ToolError(f"The path {final_path} is a directory and only the `view` command can be used on directories")
-        
-        print(f"Final validated path: {final_path} (exists: {final_path.exists()})", file=sys.stderr)
-        return final_path
+        _trace(trace, "Final validated path: %s", final_str)
+        return self._check_dir_rules(command, final_str)
+
+    def _check_dir_rules(self, command: str, path_str: str) -> Path:
+        """Check that command may be used on the existing path and return it as a Path."""
+        if os.path.isdir(path_str):
+            if command == "create":
+                raise ToolError(f"Path {path_str} is a directory. Cannot create a file with the same name.")
+            # Check if the path points to a directory for non-view commands
+            if command != "view":
+                raise ToolError(f"The path {path_str} is a directory and only the `view` command can be used on directories")
+        elif command == "create":
+            raise ToolError(f"File already exists at: {path_str}. Cannot overwrite files using command `create`.")
+        return Path(path_str)
 
     async def view(
         self, path: Path, view_range: list[int] | None = None
@@ -289,45 +467,17 @@ Notes for using the `str_replace` command:
                     error_code=1
                 )
 
-            # Use Windows-compatible directory listing
-            import os
-            if os.name == 'nt':
-                # Windows: use dir command or Python's os.walk
-                try:
-                    verified_files = []
-                    # List only files and directories that actually exist
-                    for item in path.iterdir():
-                        if not item.name.startswith('.') and item.exists():  # Exclude hidden items and verify existence
-                            if item.is_dir():
-                                verified_files.append(f"{item.name}/")
-                                # List one level deeper
-                                try:
-                                    for subitem in item.iterdir():
-                                        if not subitem.name.startswith('.') and subitem.exists():
-                                            if subitem.is_dir():
-                                                verified_files.append(f"{item.name}/{subitem.name}/")
-                                            else:
-                                                verified_files.append(f"{item.name}/{subitem.name}")
-                                except (PermissionError, OSError):
-                                    continue
-                            else:
-                                verified_files.append(item.name)
-                    
-                    stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n"
-                    stdout += "\n".join(verified_files) + "\n"
-                    return ToolExecResult(error_code=0, output=stdout, error="")
-                except Exception as e:
-                    return ToolExecResult(error_code=1, output="", error=str(e))
-            else:
-                # Unix-like systems: use find command
-                return_code, stdout, stderr = await run(
-                    rf"find {path} -maxdepth 2 -not -path '*/\.*'"
-                )
-                if not stderr:
-                    stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{stdout}\n"
-                return ToolExecResult(error_code=return_code, output=stdout, error=stderr)
+            # List in-process on every platform instead of spawning `find`
+            try:
+                verified_files = await asyncio.to_thread(_list_directory, str(path))
+            except Exception as e:
+                return ToolExecResult(error_code=1, output="", error=str(e))
+
+            stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n"
+            stdout += maybe_truncate("\n".join(verified_files)) + "\n"
+            return ToolExecResult(error_code=0, output=stdout, error="")
 
-        file_content = self.read_file(path)
+        file_content = await self.read_file(path)
         init_line = 1
         if view_range:
             if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):  # pyright: ignore[reportUnnecessaryIsInstance]
@@ -359,14 +509,14 @@ Notes for using the `str_replace` command:
             output=self._make_output(file_content, str(path), init_line=init_line)
         )
 
-    def str_replace(
+    async def str_replace(
         self, path: Path, old_str: str, new_str: str | None
     ) -> ToolExecResult:
         """Implement the str_replace command, which replaces old_str with new_str in the file content"""
         # Read the file content
-        file_content = self.read_file(path).expandtabs()
-        old_str = old_str.expandtabs()
-        new_str = new_str.expandtabs() if new_str is not None else ""
+        file_content = _expandtabs(await self.read_file(path))
+        old_str = _expandtabs(old_str)
+        new_str = _expandtabs(new_str) if new_str is not None else ""
 
         # Check if old_str is empty
         if not old_str:
@@ -375,30 +525,27 @@ Notes for using the `str_replace` command:
             )
 
         # Check if old_str is unique in the file
-        occurrences = file_content.count(old_str)
-        if occurrences == 0:
+        occurrences = _find_occurrences(file_content, old_str)
+        if not occurrences:
             raise ToolError(
                 f"No replacement was performed, old_str `{old_str}` did not appear verbatim in {path}."
             )
-        elif occurrences > 1:
-            file_content_lines = file_content.split("\n")
-            lines = [
-                idx + 1
-                for idx, line in enumerate(file_content_lines)
-                if old_str in line
-            ]
+        elif len(occurrences) > 1:
+            lines = sorted({line + 1 for _, line in occurrences})
             raise ToolError(
                 f"No replacement was performed. Multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
             )
 
         # Replace old_str with new_str
-        new_file_content = file_content.replace(old_str, new_str)
+        match_pos, replacement_line = occurrences[0]
+        new_file_content = (
+            file_content[:match_pos] + new_str + file_content[match_pos + len(old_str) :]
+        )
 
         # Write the new content to the file
-        self.write_file(path, new_file_content)
+        await self.write_file(path, new_file_content)
 
         # Create a snippet of the edited section
-        replacement_line = file_content.split(old_str)[0].count("\n")
         start_line = max(0, replacement_line - SNIPPET_LINES)
         end_line = replacement_line + SNIPPET_LINES + new_str.count("\n")
         snippet = "\n".join(new_file_content.split("\n")[start_line : end_line + 1])
@@ -414,34 +561,50 @@ Notes for using the `str_replace` command:
             output=success_msg,
         )
 
-    def insert(self, path: Path, insert_line: int, new_str: str) -> ToolExecResult:
+    async def insert(self, path: Path, insert_line: int, new_str: str) -> ToolExecResult:
         """Implement the insert command, which inserts new_str at the specified line in the file content."""
-        file_text = self.read_file(path).expandtabs()
-        new_str = new_str.expandtabs()
-        file_text_lines = file_text.split("\n")
-        n_lines_file = len(file_text_lines)
+        # Work on the undecoded bytes; only the snippet around the insertion is decoded
+        raw = await self.read_file_bytes(path)
+        new_str = _expandtabs(new_str)
+        if _IS_NT and not new_str.isascii():
+            new_str = _EMOJI_RE.sub('', new_str)
+        n_lines_file = raw.count(b"\n") + 1
 
         if insert_line < 0 or insert_line > n_lines_file:
             raise ToolError(
                 f"Invalid `insert_line` parameter: {insert_line}. It should be within the range of lines of the file: {[0, n_lines_file]}"
             )
 
-        new_str_lines = new_str.split("\n")
-        new_file_text_lines = (
-            file_text_lines[:insert_line]
-            + new_str_lines
-            + file_text_lines[insert_line:]
-        )
+        # Keep the file's existing line endings for the inserted lines
+        eol = b"\r\n" if b"\r\n" in raw else b"\n"
+        new_bytes = new_str.encode('utf-8').replace(b"\n", eol)
+
+        # Offset where line `insert_line` starts; past the end when appending after the last line.
+        # The head and tail are written through memoryview slices, so the file is never copied.
+        if insert_line < n_lines_file:
+            cut = _skip_lines(raw, 0, insert_line)
+            raw_view = memoryview(raw)
+            chunks = (raw_view[:cut], new_bytes, eol, raw_view[cut:])
+        else:
+            cut = len(raw) + 1
+            chunks = (raw, eol, new_bytes)
+
+        before = _lines_back(raw, cut, SNIPPET_LINES)
         snippet_lines = (
-            file_text_lines[max(0, insert_line - SNIPPET_LINES) : insert_line]
-            + new_str_lines
-            + file_text_lines[insert_line : insert_line + SNIPPET_LINES]
+            _decode_lines(raw[before : cut - 1]).removesuffix("\r").split("\n")
+            if insert_line
+            else []
         )
-
-        new_file_text = "\n".join(new_file_text_lines)
+        snippet_lines += new_str.split("\n")
+        if insert_line < n_lines_file:
+            after = _skip_lines(raw, cut, SNIPPET_LINES)
+            snippet_lines += _decode_lines(raw[cut:after]).split("\n")[:SNIPPET_LINES]
         snippet = "\n".join(snippet_lines)
 
-        self.write_file(path, new_file_text)
+        try:
+            await asyncio.to_thread(_write_chunks, path, chunks)
+        except Exception as e:
+            raise ToolError(f"Ran into {e} while trying to write to {path}") from None
 
         success_msg = f"The file {path} has been edited. "
         success_msg += self._make_output(
@@ -456,67 +619,30 @@ Notes for using the `str_replace` command:
 
     # Note: undo_edit method is not implemented in this version as it was removed
 
-    def read_file(self, path: Path):
+    async def read_file(self, path: Path) -> str:
         """Read the content of a file from a given path; raise a ToolError if an error occurs."""
         try:
-            # Double check that the file exists before attempting to read it
-            if not path.exists():
-                raise FileNotFoundError(f"File not found: {path}")
-            
-            # Confirm it's a file and not a directory
-            if not path.is_file():
-                raise IsADirectoryError(f"Path is not a file: {path}")
-                
-            return path.read_text(encoding='utf-8', errors='replace')
+            return await asyncio.to_thread(path.read_text, encoding='utf-8', errors='replace')
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to read {path}") from None
 
-    def write_file(self, path: Path, file: str):
+    async def read_file_bytes(self, path: Path) -> bytes:
+        """Read the raw content of a file from a given path; raise a ToolError if an error occurs."""
+        try:
+            return await asyncio.to_thread(path.read_bytes)
+        except Exception as e:
+            raise ToolError(f"Ran into {e} while trying to read {path}") from None
+
+    async def write_file(self, path: Path, file: str) -> None:
         """Write the content of a file to a given path; raise a ToolError if an error occurs."""
         try:
-            import os
-            
-            # Create parent directory if it doesn't exist
-            if not path.parent.exists():
-                try:
-                    path.parent.mkdir(parents=True, exist_ok=True)
-                except Exception as mkdir_error:
-                    raise ToolError(f"Failed to create directory {path.parent}: {mkdir_error}")
-            
-            # Double check parent directory exists before proceeding
-            if not path.parent.exists():
-                raise FileNotFoundError(f"Parent directory not found: {path.parent}")
-                
             # Use utf-8 encoding with error handling
             # Filter out problematic characters for Windows systems if needed
-            if os.name == 'nt':
-                # Replace or remove any characters that might cause encoding issues on Windows
-                import re
-                # Pattern to match emojis and other problematic characters
-                emoji_pattern = re.compile("["
-                    u"\U0001F600-\U0001F64F"  # emoticons
-                    u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                    u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                    u"\U0001F700-\U0001F77F"  # alchemical symbols
-                    u"\U0001F780-\U0001F7FF"  # Geometric Shapes
-                    u"\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
-                    u"\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
-                    u"\U0001FA00-\U0001FA6F"  # Chess Symbols
-                    u"\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
-                    u"\U00002702-\U000027B0"  # Dingbats
-                    "]+", flags=re.UNICODE)
-                file = emoji_pattern.sub(r'', file)
-            
-            # Write the file
-            _ = path.write_text(file, encoding='utf-8')
-            
-            # Verify the file was written successfully
-            if not path.exists():
-                raise FileNotFoundError(f"File was not created: {path}")
-                
-            if not path.is_file():
-                raise IsADirectoryError(f"Created path is not a file: {path}")
-                
+            if _IS_NT and not file.isascii():
+                # Remove any characters that might cause encoding issues on Windows
+                file = _EMOJI_RE.sub('', file)
+
+            await asyncio.to_thread(_write_text, path, file)
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to write to {path}") from None
 
@@ -530,15 +656,9 @@ Notes for using the `str_replace` command:
         """Generate output for the CLI based on the content of a file."""
         file_content = maybe_truncate(file_content)
         if expand_tabs:
-            file_content = file_content.expandtabs()
-        file_content = "\n".join(
-            [
-                f"{i + init_line:6}\t{line}"
-                for i, line in enumerate(file_content.split("\n"))
-            ]
-        )
-        return (
-            f"Here's the result of running `cat -n` on {file_descriptor}:\n"
-            + file_content
-            + "\n"
-        )
+            file_content = _expandtabs(file_content)
+        output = io.StringIO()
+        _ = output.write(f"Here's the result of running `cat -n` on {file_descriptor}:\n")
+        for line_number, line in enumerate(file_content.split("\n"), init_line):
+            _ = output.write("%6d\t%s\n" % (line_number, line))
+        return output.getvalue()
@@ -30,6 +30,13 @@ class ModelParameters:
     max_retries: int
     base_url: str | None = None
     api_version: str | None = None
+    retry_base_delay: float = 1.0
+    retry_max_delay: float = 60.0
+    recent_messages: int | None = None
+    cache_buffer: int = 0
+    max_history_tokens: int | None = None
+    requests_per_minute: int | None = None
+    tokens_per_minute: int | None = None
 
 
 @dataclass
@@ -102,6 +109,25 @@ class Config:
                     api_version=str(provider_config.get("api_version"))
                     if "api_version" in provider_config
                     else None,
+                    retry_base_delay=float(
+                        provider_config.get("retry_base_delay", 1.0)
+                    ),
+                    retry_max_delay=float(provider_config.get("retry_max_delay", 60.0)),
+                    recent_messages=int(provider_config.get("recent_messages", 0))
+                    if "recent_messages" in provider_config
+                    else None,
+                    cache_buffer=int(provider_config.get("cache_buffer", 0)),
+                    max_history_tokens=int(provider_config.get("max_history_tokens", 0))
+                    if "max_history_tokens" in provider_config
+                    else None,
+                    requests_per_minute=int(
+                        provider_config.get("requests_per_minute", 0)
+                    )
+                    if "requests_per_minute" in provider_config
+                    else None,
+                    tokens_per_minute=int(provider_config.get("tokens_per_minute", 0))
+                    if "tokens_per_minute" in provider_config
+                    else None,
                 )
 
         if "lakeview_config" in self._config:
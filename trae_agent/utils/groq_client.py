@@ -1,258 +1,1075 @@
-# Fwedpat Groq Client addition.
-
-"""Groq API client wrapper with tool integration."""
-
-import os
-import json
-import random
-import time
-import openai
-from openai.types.chat import (
-    ChatCompletionFunctionMessageParam,
-    ChatCompletionMessageParam,
-    ChatCompletionToolParam,
-    ChatCompletionSystemMessageParam,
-    ChatCompletionAssistantMessageParam,
-    ChatCompletionMessageToolCallParam,
-    ChatCompletionUserMessageParam,
-)
-from openai.types.chat.chat_completion_message_tool_call_param import Function
-from openai.types.chat.chat_completion_tool_message_param import (
-    ChatCompletionToolMessageParam,
-)
-from openai.types.shared_params.function_definition import FunctionDefinition
-from typing import override
-
-from ..tools.base import Tool, ToolCall
-from ..utils.config import ModelParameters
-from .base_client import BaseLLMClient
-from .llm_basics import LLMMessage, LLMResponse, LLMUsage
-
-
-class GroqClient(BaseLLMClient):
-    """Groq API client wrapper with tool integration."""
-
-    def __init__(self, model_parameters: ModelParameters):
-        """Initialize the GroqClient."""
-        super().__init__(model_parameters)
-        
-        if self.api_key == "":
-            self.api_key: str = os.getenv("GROQ_API_KEY", "")
-
-        if self.api_key == "":
-            raise ValueError(
-                "Groq API key not provided. Set GROQ_API_KEY in environment variables or config file."
-            )
-        
-        self.client: openai.OpenAI = openai.OpenAI(
-            api_key=self.api_key, base_url="https://api.groq.com/openai/v1",
-        )
-
-        self.message_history: list[ChatCompletionMessageParam] = []
-
-    @override
-    def set_chat_history(self, messages: list[LLMMessage]) -> None:
-        """Set the chat history."""
-        self.message_history = self.parse_messages(messages)
-
-    @override
-    def chat(
-        self,
-        messages: list[LLMMessage],
-        model_parameters: ModelParameters,
-        tools: list[Tool] | None = None,
-        reuse_history: bool = True,
-    ) -> LLMResponse:
-        """Send chat messages to Groq with optional tool support."""
-        groq_messages = self.parse_messages(messages)
-        if reuse_history:
-            self.message_history = self.message_history + groq_messages
-        else:
-            self.message_history = groq_messages
-
-        tool_schemas = None
-        if tools:
-            tool_schemas = [
-                ChatCompletionToolParam(
-                    function=FunctionDefinition(
-                        name=tool.get_name(),
-                        description=tool.get_description(),
-                        parameters=tool.get_input_schema(),
-                    ),
-                    type="function",
-                )
-                for tool in tools
-            ]
-
-        
-        response = None
-        error_message = ""
-        for i in range(model_parameters.max_retries):
-            try:
-                response = self.client.chat.completions.create(
-                    model=model_parameters.model,
-                    messages=self.message_history,
-                    tools=tool_schemas if tool_schemas else openai.NOT_GIVEN,
-                    temperature=model_parameters.temperature,
-                    top_p=model_parameters.top_p,
-                    max_tokens=model_parameters.max_tokens,
-                    n=1,
-                )
-                break
-            except Exception as e:
-                error_message += f"Error {i + 1}: {str(e)}\n"
-                # Randomly sleep for 3-30 seconds
-                time.sleep(random.randint(3, 30))
-                continue
-
-        if response is None:
-            raise ValueError(
-                f"Failed to get response from Groq after max retries: {error_message}"
-            )
-
-        choice = response.choices[0]
-
-        tool_calls = None
-        if choice.message.tool_calls:
-            tool_calls: list[ToolCall] | None = []
-            for tool_call in choice.message.tool_calls:
-                tool_calls.append(
-                    ToolCall(
-                        name=tool_call.function.name,
-                        call_id=tool_call.id,
-                        arguments=(
-                            json.loads(tool_call.function.arguments)
-                            if tool_call.function.arguments
-                            else {}
-                        ),
-                    )
-                )
-
-        llm_response = LLMResponse(
-            content=choice.message.content or "",
-            tool_calls=tool_calls,
-            finish_reason=choice.finish_reason,
-            model=response.model,
-            usage=(
-                LLMUsage(
-                    input_tokens=response.usage.prompt_tokens,
-                    output_tokens=response.usage.completion_tokens,
-                )
-                if response.usage
-                else None
-            ),
-        )
-
-        # update message history
-        if llm_response.tool_calls:
-            self.message_history.append(
-                ChatCompletionAssistantMessageParam(
-                    role="assistant",
-                    content=llm_response.content,
-                    tool_calls=[
-                        ChatCompletionMessageToolCallParam(
-                            id=tool_call.call_id,
-                            function=Function(
-                                name=tool_call.name,
-                                arguments=json.dumps(tool_call.arguments),
-                            ),
-                            type="function",
-                        )
-                        for tool_call in llm_response.tool_calls
-                    ],
-                )
-            )
-        elif llm_response.content:
-            self.message_history.append(
-                ChatCompletionAssistantMessageParam(
-                    content=llm_response.content, role="assistant"
-                )
-            )
-
-        if self.trajectory_recorder:
-            self.trajectory_recorder.record_llm_interaction(
-                messages=messages,
-                response=llm_response,
-                provider="Groq",
-                model=model_parameters.model,
-                tools=tools,
-            )
-
-        return llm_response
-
-
-    @override
-    def supports_tool_calling(self, model_parameters: ModelParameters) -> bool:
-        """Check if the current model supports tool calling."""
-        # Most modern models on Groq support tool calling
-        # We'll be conservative and check for known capable models
-        tool_capable_patterns = [
-            "kimi-k2-instruct",
-            "llama-4-maverick",
-            "deepseek-r1-distill-llama-70b",
-            "llama-3.3-70b-versatile",
-            "gemma2",
-        ]
-        return any(
-            pattern in model_parameters.model.lower()
-            for pattern in tool_capable_patterns
-        )
-
-    
-    def parse_messages(
-        self, messages: list[LLMMessage]
-    ) -> list[ChatCompletionMessageParam]:
-        groq_messages: list[ChatCompletionMessageParam] = []
-        for msg in messages:
-            if msg.tool_call:
-                groq_messages.append(
-                    ChatCompletionFunctionMessageParam(
-                        content=json.dumps(
-                            {
-                                "name": msg.tool_call.name,
-                                "arguments": msg.tool_call.arguments,
-                            }
-                        ),
-                        role="function",
-                        name=msg.tool_call.name,
-                    )
-                )
-            elif msg.tool_result:
-                result: str = ""
-                if msg.tool_result.result:
-                    result = result + msg.tool_result.result + "\n"
-                if msg.tool_result.error:
-                    result += "Tool call failed with error:\n"
-                    result += msg.tool_result.error
-                result = result.strip()
-
-                groq_messages.append(
-                    ChatCompletionToolMessageParam(
-                        content=result,
-                        role="tool",
-                        tool_call_id=msg.tool_result.call_id,
-                    )
-                )
-            elif msg.role == "system":
-                if not msg.content:
-                    raise ValueError("System message content is required")
-                groq_messages.append(
-                    ChatCompletionSystemMessageParam(content=msg.content, role="system")
-                )
-            elif msg.role == "user":
-                if not msg.content:
-                    raise ValueError("User message content is required")
-                groq_messages.append(
-                    ChatCompletionUserMessageParam(content=msg.content, role="user")
-                )
-            elif msg.role == "assistant":
-                if not msg.content:
-                    raise ValueError("Assistant message content is required")
-                groq_messages.append(
-                    ChatCompletionAssistantMessageParam(
-                        content=msg.content, role="assistant"
-                    )
-                )
-            else:
-                raise ValueError(f"Invalid message role: {msg.role}")
-        return groq_messages
\ No newline at end of file
+# Fwedpat Groq Client addition.
+
+"""Groq API client wrapper with tool integration."""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import contextlib
+import functools
+import importlib.util
+import os
+import json
+import queue
+import random
+import re
+import threading
+import time
+import openai
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import TYPE_CHECKING, Any, override
+
+from ..tools.base import Tool, ToolCall, ToolResult
+from ..utils.config import ModelParameters
+from .base_client import BaseLLMClient
+from .llm_basics import LLMMessage, LLMResponse, LLMUsage
+from .trajectory_recorder import TrajectoryRecorder
+
+if TYPE_CHECKING:
+    # The message params are TypedDicts: plain dicts at runtime, so they are only
+    # imported for type checking and built as dict literals
+    from openai.types.chat import ChatCompletionMessageParam, ChatCompletionToolParam
+
+try:
+    import orjson
+
+    def _json_dumps(obj: object) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS).decode()
+
+    _json_loads = orjson.loads
+except ImportError:  # orjson is optional; fall back to the standard library
+
+    def _json_dumps(obj: object) -> str:
+        # Same bytes as orjson, so the prompt prefix does not depend on what is installed
+        return json.dumps(
+            obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+        )
+
+    _json_loads = json.loads
+
+_GROQ_BASE_URL = "https://api.groq.com/openai/v1"
+
+# httpx only speaks HTTP/2 when the optional h2 package is installed
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+# Errors that will fail the same way however often the request is repeated
+_FATAL_ERRORS = (
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+    openai.BadRequestError,
+    openai.NotFoundError,
+    openai.UnprocessableEntityError,
+)
+
+# Groq's rate limit message, e.g. "Please try again in 1m2.5s" or "in 250ms"
+_TRY_AGAIN_RE = re.compile(r"try again in (?:(\d+)m(?!s))?([\d.]+)(ms|s)")
+
+
+def _is_tool_use_failure(error: Exception) -> bool:
+    """Whether error is Groq's 400 for a malformed tool call the model generated.
+
+    The request itself is fine, so a fresh sample usually succeeds.
+    """
+    return (
+        isinstance(error, openai.BadRequestError)
+        and getattr(error, "code", None) == "tool_use_failed"
+    )
+
+
+def _retry_hint(error: Exception) -> float | None:
+    """Return the wait in seconds requested by a rate limit error, if it gives one."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    match = _TRY_AGAIN_RE.search(str(error))
+    if match:
+        minutes, amount, unit = match.groups()
+        seconds = float(amount) / 1000 if unit == "ms" else float(amount)
+        return seconds + 60 * int(minutes or 0)
+    return None
+
+
+def _retry_delay(
+    error: Exception, attempt: int, model_parameters: ModelParameters
+) -> float | None:
+    """Seconds to wait before retrying after error, or None if it should not be retried.
+
+    Waits never exceed retry_max_delay, including ones requested by Groq.
+    """
+    if isinstance(error, _FATAL_ERRORS) and not _is_tool_use_failure(error):
+        return None
+    hint = _retry_hint(error)
+    if hint is not None:
+        # Daily limits ask for waits of many minutes; never wait longer than the cap
+        return min(hint, model_parameters.retry_max_delay)
+    # Exponential backoff with jitter
+    base = model_parameters.retry_base_delay
+    return min(model_parameters.retry_max_delay, base * 2**attempt) + random.uniform(
+        0, base
+    )
+
+
+def _function_message(tool_call: ToolCall) -> ChatCompletionMessageParam:
+    return {
+        "content": _json_dumps(
+            {"name": tool_call.name, "arguments": tool_call.arguments}
+        ),
+        "role": "function",
+        "name": tool_call.name,
+    }
+
+
+def _tool_message(tool_result: ToolResult) -> ChatCompletionMessageParam:
+    result: str = ""
+    if tool_result.result:
+        result = result + tool_result.result + "\n"
+    if tool_result.error:
+        result += "Tool call failed with error:\n"
+        result += tool_result.error
+    return {
+        "content": result.strip(),
+        "role": "tool",
+        "tool_call_id": tool_result.call_id,
+    }
+
+
+def _system_message(msg: LLMMessage) -> ChatCompletionMessageParam:
+    if not msg.content:
+        raise ValueError("System message content is required")
+    return {"content": msg.content, "role": "system"}
+
+
+def _user_message(msg: LLMMessage) -> ChatCompletionMessageParam:
+    if not msg.content:
+        raise ValueError("User message content is required")
+    return {"content": msg.content, "role": "user"}
+
+
+def _assistant_message(msg: LLMMessage) -> ChatCompletionMessageParam:
+    if not msg.content:
+        raise ValueError("Assistant message content is required")
+    return {"content": msg.content, "role": "assistant"}
+
+
+# Parsed messages kept per client, so replayed histories are not converted again
+_PARSE_CACHE_SIZE = 1024
+
+# Tool sets whose schemas are kept per client; an agent reuses one or two of them
+_TOOL_CACHE_SIZE = 8
+
+# Message builders by role, for messages that carry no tool call or tool result
+_ROLE_BUILDERS: dict[str, Callable[[LLMMessage], ChatCompletionMessageParam]] = {
+    "system": _system_message,
+    "user": _user_message,
+    "assistant": _assistant_message,
+}
+
+
+def _tool_group_start(
+    messages: list[ChatCompletionMessageParam], start: int, floor: int
+) -> int:
+    """Move start back, not below floor, so it does not land on a tool result.
+
+    A tool result cannot be sent without the assistant message holding its tool call,
+    so a range opening inside a run of tool results is widened to that message.
+    """
+    while start > floor and messages[start]["role"] == "tool":
+        start -= 1
+    return start
+
+
+def _message_key(msg: LLMMessage) -> tuple[str | None, ...] | None:
+    """Key identifying what msg parses to, or None if it should not be cached."""
+    if msg.tool_call:
+        # The arguments are an unhashable dict; tool call messages are rare anyway
+        return None
+    if msg.tool_result:
+        tool_result = msg.tool_result
+        return ("tool", tool_result.call_id, tool_result.result, tool_result.error)
+    return (msg.role, msg.content)
+
+
+def _parse_message(msg: LLMMessage) -> ChatCompletionMessageParam:
+    """Convert one LLMMessage to the Groq (OpenAI compatible) message format."""
+    if msg.tool_call:
+        return _function_message(msg.tool_call)
+    if msg.tool_result:
+        return _tool_message(msg.tool_result)
+    builder = _ROLE_BUILDERS.get(msg.role)
+    if builder is None:
+        raise ValueError(f"Invalid message role: {msg.role}")
+    return builder(msg)
+
+
+# Most modern models on Groq support tool calling
+# We'll be conservative and check for known capable models
+_TOOL_CAPABLE_RE = re.compile(
+    "|".join(
+        map(
+            re.escape,
+            [
+                "kimi-k2-instruct",
+                "llama-4-maverick",
+                "deepseek-r1-distill-llama-70b",
+                "llama-3.3-70b-versatile",
+                "gemma2",
+            ],
+        )
+    ),
+    re.IGNORECASE,
+)
+
+
+@functools.lru_cache(maxsize=32)
+def _supports_tool_calling(model: str) -> bool:
+    return _TOOL_CAPABLE_RE.search(model) is not None
+
+
+class _RateLimiter:
+    """Token bucket holding up to a minute's worth of capacity, refilled continuously."""
+
+    def __init__(self, per_minute: int):
+        self.capacity: float = float(per_minute)
+        self.refill_per_sec: float = per_minute / 60
+        self._tokens: float = self.capacity
+        self._updated: float = time.monotonic()
+        # Shared by the sync and async paths, which may run on different threads
+        self._lock: threading.Lock = threading.Lock()
+
+    def reserve(self, tokens: float) -> float:
+        """Take tokens from the bucket and return the seconds to wait before using them.
+
+        The balance may go negative, so concurrent callers queue up behind each other
+        instead of all waking when the bucket refills.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= min(tokens, self.capacity)
+            return max(0.0, -self._tokens / self.refill_per_sec)
+
+    def release(self, tokens: float) -> None:
+        """Return unused reserved tokens to the bucket; a negative amount takes more."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def limit(self, remaining: float) -> None:
+        """Lower the balance to the remaining capacity reported by the server."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, remaining)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.refill_per_sec
+        )
+        self._updated = now
+
+
+# Sync clients by (api_key, base_url), so every GroqClient (e.g. sub-agents) shares
+# one connection pool
+_CLIENT_CACHE: dict[tuple[str, str], openai.OpenAI] = {}
+_CLIENT_CACHE_LOCK = threading.Lock()
+
+
+def _shared_client(api_key: str, base_url: str) -> openai.OpenAI:
+    """Return the shared sync client for api_key and base_url, creating it once."""
+    key = (api_key, base_url)
+    with _CLIENT_CACHE_LOCK:
+        client = _CLIENT_CACHE.get(key)
+        if client is None:
+            # Retries are handled by GroqClient itself
+            client = openai.OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                http_client=openai.DefaultHttpxClient(http2=_HTTP2),
+            )
+            _CLIENT_CACHE[key] = client
+        return client
+
+
+# Interactions waiting to be written by the trajectory recorder thread. Recording saves
+# the whole trajectory file, so it is kept off the request path.
+_trajectory_queue: queue.Queue[
+    tuple[
+        TrajectoryRecorder, list[LLMMessage], LLMResponse, str, list[Tool] | None
+    ]
+] = queue.Queue(maxsize=256)
+_trajectory_thread: threading.Thread | None = None
+_trajectory_thread_lock = threading.Lock()
+
+
+def _drain_trajectory_queue() -> None:
+    while True:
+        recorder, messages, llm_response, model, tools = _trajectory_queue.get()
+        try:
+            recorder.record_llm_interaction(
+                messages=messages,
+                response=llm_response,
+                provider="Groq",
+                model=model,
+                tools=tools,
+            )
+        except Exception as e:
+            print(f"Warning: Failed to record Groq interaction: {e}")
+        finally:
+            _trajectory_queue.task_done()
+
+
+def _record_in_background(
+    recorder: TrajectoryRecorder,
+    messages: list[LLMMessage],
+    llm_response: LLMResponse,
+    model: str,
+    tools: list[Tool] | None,
+) -> None:
+    """Queue an interaction for the recorder thread, starting the thread on first use."""
+    global _trajectory_thread
+    with _trajectory_thread_lock:
+        if _trajectory_thread is None:
+            _trajectory_thread = threading.Thread(
+                target=_drain_trajectory_queue, name="groq-trajectory", daemon=True
+            )
+            _trajectory_thread.start()
+            atexit.register(_trajectory_queue.join)
+    _trajectory_queue.put((recorder, messages, llm_response, model, tools))
+
+
+class GroqClient(BaseLLMClient):
+    """Groq API client wrapper with tool integration."""
+
+    def __init__(self, model_parameters: ModelParameters):
+        """Initialize the GroqClient."""
+        super().__init__(model_parameters)
+        
+        if self.api_key == "":
+            self.api_key: str = os.getenv("GROQ_API_KEY", "")
+
+        if self.api_key == "":
+            raise ValueError(
+                "Groq API key not provided. Set GROQ_API_KEY in environment variables or config file."
+            )
+        
+        self.client: openai.OpenAI = _shared_client(self.api_key, _GROQ_BASE_URL)
+        # Async connection pools belong to the event loop that opened them, so the
+        # async client is not shared between instances
+        self.aclient: openai.AsyncOpenAI = openai.AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=_GROQ_BASE_URL,
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(http2=_HTTP2),
+        )
+
+        self.message_history: list[ChatCompletionMessageParam] = []
+        # Index of the first non-system message sent when the history window is enabled
+        self._window_start: int = 0
+        # Estimated token counts by id(message), holding the message to detect id reuse
+        self._token_counts: dict[int, tuple[ChatCompletionMessageParam, int]] = {}
+        # Tool schemas by tool identity, least recently used first; the tools are kept
+        # so their ids stay unique
+        self._tool_cache: OrderedDict[
+            tuple[tuple[int, str], ...],
+            tuple[list[Tool], list[ChatCompletionToolParam]],
+        ] = OrderedDict()
+        # Client-side limits, so requests wait for capacity instead of running into 429s
+        self._request_limiter: _RateLimiter | None = (
+            _RateLimiter(model_parameters.requests_per_minute)
+            if model_parameters.requests_per_minute
+            else None
+        )
+        self._token_limiter: _RateLimiter | None = (
+            _RateLimiter(model_parameters.tokens_per_minute)
+            if model_parameters.tokens_per_minute
+            else None
+        )
+        # Parsed messages by _message_key(), least recently used first
+        self._parse_cache: OrderedDict[
+            tuple[str | None, ...], ChatCompletionMessageParam
+        ] = OrderedDict()
+        # Held for the whole of each achat()/achat_stream() call, so turns on the
+        # shared history do not interleave
+        self._history_lock: asyncio.Lock = asyncio.Lock()
+
+    @override
+    def set_chat_history(self, messages: list[LLMMessage]) -> None:
+        """Set the chat history."""
+        self.message_history = self.parse_messages(messages)
+        self._window_start = 0
+
+    @override
+    def chat(
+        self,
+        messages: list[LLMMessage],
+        model_parameters: ModelParameters,
+        tools: list[Tool] | None = None,
+        reuse_history: bool = True,
+    ) -> LLMResponse:
+        """Send chat messages to Groq with optional tool support."""
+        self._add_to_history(self.parse_messages(messages), reuse_history)
+        tool_schemas = self._build_tool_schemas(tools)
+        payload = self._request_messages(model_parameters)
+
+        wait, reserved_tokens = self._reserve_capacity(payload, model_parameters)
+        if wait:
+            time.sleep(wait)
+
+        response = None
+        error_message = ""
+        for i in range(model_parameters.max_retries):
+            try:
+                response = self.client.chat.completions.with_raw_response.create(
+                    **self._completion_kwargs(payload, model_parameters, tool_schemas)
+                )
+                self._update_rate_limits(response.headers)
+                break
+            except Exception as e:
+                error_message += f"Error {i + 1}: {str(e)}\n"
+                delay = _retry_delay(e, i, model_parameters)
+                if delay is None:
+                    self._release_capacity(reserved_tokens, None)
+                    raise ValueError(
+                        f"Groq rejected the request, not retrying: {error_message}"
+                    ) from e
+                if i + 1 < model_parameters.max_retries:
+                    time.sleep(delay)
+                continue
+
+        if response is None:
+            self._release_capacity(reserved_tokens, None)
+            raise ValueError(
+                f"Failed to get response from Groq after max retries: {error_message}"
+            )
+
+        llm_response = self._parse_response(_json_loads(response.content))
+        self._release_capacity(reserved_tokens, llm_response.usage)
+        self._add_response_to_history(llm_response)
+        self._record(messages, llm_response, model_parameters, tools)
+        return llm_response
+
+    async def achat(
+        self,
+        messages: list[LLMMessage],
+        model_parameters: ModelParameters,
+        tools: list[Tool] | None = None,
+        reuse_history: bool = True,
+    ) -> LLMResponse:
+        """Asynchronous counterpart of chat() that does not block the event loop.
+
+        Concurrent calls on the same client share one history, so they run one after
+        another; use abatch() for independent requests that should run in parallel.
+        """
+        async with self._history_lock:
+            self._add_to_history(self.parse_messages(messages), reuse_history)
+            # Snapshot, since the sync chat() may change the history during the await
+            payload = list(self._request_messages(model_parameters))
+
+            llm_response = await self._acomplete(
+                payload, model_parameters, self._build_tool_schemas(tools)
+            )
+
+            self._add_response_to_history(llm_response)
+        self._record(messages, llm_response, model_parameters, tools)
+        return llm_response
+
+    async def achat_stream(
+        self,
+        messages: list[LLMMessage],
+        model_parameters: ModelParameters,
+        tools: list[Tool] | None = None,
+        reuse_history: bool = True,
+    ) -> AsyncIterator[LLMResponse]:
+        """Streaming counterpart of achat().
+
+        Yields an LLMResponse holding each piece of content as it arrives, with no
+        finish_reason. The last response yielded is the complete one, with the full
+        content, tool calls, finish_reason and usage; it is the one added to the
+        history and recorded.
+
+        The stream is read by a separate task that holds the history lock, so other
+        achat() or achat_stream() calls wait until the stream has finished, even if
+        this generator is abandoned. Closing the generator early cancels the request
+        and takes the new messages back out of the history.
+        """
+        responses: asyncio.Queue[LLMResponse | Exception | None] = asyncio.Queue()
+
+        async def read_stream() -> None:
+            try:
+                async with self._history_lock:
+                    async for llm_response in self._astream(
+                        messages, model_parameters, tools, reuse_history
+                    ):
+                        responses.put_nowait(llm_response)
+            except Exception as e:
+                responses.put_nowait(e)
+            else:
+                responses.put_nowait(None)
+
+        reader = asyncio.create_task(read_stream())
+        try:
+            while (item := await responses.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            if not reader.done():
+                _ = reader.cancel()
+                _ = await asyncio.wait([reader])
+
+    async def _astream(
+        self,
+        messages: list[LLMMessage],
+        model_parameters: ModelParameters,
+        tools: list[Tool] | None,
+        reuse_history: bool,
+    ) -> AsyncIterator[LLMResponse]:
+        """Body of achat_stream(), run while the history lock is held.
+
+        If the stream fails or is cancelled before it completes, its reservation is
+        refunded and the history is restored to what it was before the call.
+        """
+        previous_history = self.message_history
+        previous_len = len(previous_history)
+        previous_window_start = self._window_start
+        self._add_to_history(self.parse_messages(messages), reuse_history)
+
+        stream = None
+        reserved_tokens = 0
+        complete = False
+        try:
+            # Snapshot, since the sync chat() may change the history during the await
+            payload = list(self._request_messages(model_parameters))
+            stream, reserved_tokens = await self._acreate(
+                self.aclient.chat.completions.create,
+                model_parameters,
+                **self._completion_kwargs(
+                    payload, model_parameters, self._build_tool_schemas(tools)
+                ),
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+
+            content: list[str] = []
+            # Tool call id, name and argument fragments by the index of the tool call
+            tool_parts: dict[int, tuple[list[str], list[str], list[str]]] = {}
+            model = None
+            finish_reason = None
+            usage = None
+            async for chunk in stream:
+                model = chunk.model
+                if chunk.usage:
+                    usage = LLMUsage(
+                        input_tokens=chunk.usage.prompt_tokens,
+                        output_tokens=chunk.usage.completion_tokens,
+                    )
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                for tool_call in choice.delta.tool_calls or ():
+                    ids, names, arguments = tool_parts.setdefault(
+                        tool_call.index, ([], [], [])
+                    )
+                    if tool_call.id:
+                        ids.append(tool_call.id)
+                    if tool_call.function:
+                        if tool_call.function.name:
+                            names.append(tool_call.function.name)
+                        if tool_call.function.arguments:
+                            arguments.append(tool_call.function.arguments)
+                if choice.delta.content:
+                    content.append(choice.delta.content)
+                    yield LLMResponse(content=choice.delta.content, model=model)
+
+            tool_calls = [
+                ToolCall(
+                    name="".join(names),
+                    call_id="".join(ids),
+                    arguments=_json_loads("".join(arguments)) if arguments else {},
+                )
+                for _, (ids, names, arguments) in sorted(tool_parts.items())
+            ]
+            llm_response = LLMResponse(
+                content="".join(content),
+                tool_calls=tool_calls or None,
+                finish_reason=finish_reason,
+                model=model,
+                usage=usage,
+            )
+
+            self._release_capacity(reserved_tokens, usage)
+            self._add_response_to_history(llm_response)
+            complete = True
+            self._record(messages, llm_response, model_parameters, tools)
+            yield llm_response
+        finally:
+            if not complete:
+                if stream is not None:
+                    # _acreate refunds the reservation itself when it fails
+                    self._release_capacity(reserved_tokens, None)
+                    await stream.close()
+                del previous_history[previous_len:]
+                self.message_history = previous_history
+                self._window_start = previous_window_start
+
+    async def abatch(
+        self,
+        batches: list[tuple[list[LLMMessage], ModelParameters, list[Tool] | None]],
+        concurrency: int = 8,
+    ) -> list[LLMResponse]:
+        """Run independent chat requests concurrently, at most `concurrency` at a time.
+
+        Each request is sent with only its own messages; the shared message history is
+        neither used nor updated.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(
+            messages: list[LLMMessage],
+            model_parameters: ModelParameters,
+            tools: list[Tool] | None,
+        ) -> LLMResponse:
+            async with semaphore:
+                llm_response = await self._acomplete(
+                    self.parse_messages(messages),
+                    model_parameters,
+                    self._build_tool_schemas(tools),
+                )
+            self._record(messages, llm_response, model_parameters, tools)
+            return llm_response
+
+        return list(
+            await asyncio.gather(*(run_one(*batch) for batch in batches))
+        )
+
+    async def achat_many(
+        self,
+        requests: list[tuple[list[LLMMessage], ModelParameters]],
+        tools: list[Tool] | None = None,
+        concurrency: int = 8,
+    ) -> list[LLMResponse]:
+        """Run independent follow-up requests that share one tool set concurrently.
+
+        Like abatch(), each request carries its own messages and the shared message
+        history is left alone.
+        """
+        return await self.abatch(
+            [
+                (messages, model_parameters, tools)
+                for messages, model_parameters in requests
+            ],
+            concurrency,
+        )
+
+    async def asample(
+        self,
+        messages: list[LLMMessage],
+        model_parameters: ModelParameters,
+        n: int,
+        tools: list[Tool] | None = None,
+    ) -> list[LLMResponse]:
+        """Get n independent responses to the same messages, e.g. for voting.
+
+        Groq only accepts n=1, so the samples are sent as n concurrent requests
+        through abatch(); the shared message history is neither used nor updated.
+        """
+        return await self.abatch([(messages, model_parameters, tools)] * n, n)
+
+    async def submit_batch(
+        self, jobs: list[dict[str, Any]], completion_window: str = "24h"
+    ) -> str:
+        """Submit chat completion requests to Groq's Batch API and return the batch id.
+
+        Each job is the JSON body of one chat completion request (model, messages,
+        ...). The results are retrieved later through the batch id.
+        """
+        lines = [
+            _json_dumps(
+                {
+                    "custom_id": f"request-{i}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": job,
+                }
+            )
+            for i, job in enumerate(jobs)
+        ]
+        batch_file = await self.aclient.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode()), purpose="batch"
+        )
+        batch = await self.aclient.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=completion_window,  # pyright: ignore[reportArgumentType]
+        )
+        return batch.id
+
+    async def _acomplete(
+        self,
+        payload: list[ChatCompletionMessageParam],
+        model_parameters: ModelParameters,
+        tool_schemas: list[ChatCompletionToolParam] | None,
+    ) -> LLMResponse:
+        """Send one completion request with the async client, retrying on failure."""
+        response, reserved_tokens = await self._acreate(
+            self.aclient.chat.completions.with_raw_response.create,
+            model_parameters,
+            **self._completion_kwargs(payload, model_parameters, tool_schemas),
+        )
+        llm_response = self._parse_response(_json_loads(response.content))
+        self._release_capacity(reserved_tokens, llm_response.usage)
+        return llm_response
+
+    async def _acreate(
+        self,
+        create: Callable[..., Awaitable[Any]],
+        model_parameters: ModelParameters,
+        **kwargs: Any,
+    ) -> tuple[Any, int]:
+        """Call an async chat.completions.create() method, retrying on failure.
+
+        Returns the response and the tokens reserved for it, which the caller hands
+        back to _release_capacity() once the usage is known.
+        """
+        wait, reserved_tokens = self._reserve_capacity(
+            kwargs["messages"], model_parameters
+        )
+        if wait:
+            await asyncio.sleep(wait)
+
+        error_message = ""
+        for i in range(model_parameters.max_retries):
+            try:
+                response = await create(**kwargs)
+                headers = getattr(response, "headers", None)
+                if headers is not None:
+                    self._update_rate_limits(headers)
+                return response, reserved_tokens
+            except Exception as e:
+                error_message += f"Error {i + 1}: {str(e)}\n"
+                delay = _retry_delay(e, i, model_parameters)
+                if delay is None:
+                    self._release_capacity(reserved_tokens, None)
+                    raise ValueError(
+                        f"Groq rejected the request, not retrying: {error_message}"
+                    ) from e
+                if i + 1 < model_parameters.max_retries:
+                    await asyncio.sleep(delay)
+
+        self._release_capacity(reserved_tokens, None)
+        raise ValueError(
+            f"Failed to get response from Groq after max retries: {error_message}"
+        )
+
+    def _reserve_capacity(
+        self,
+        payload: list[ChatCompletionMessageParam],
+        model_parameters: ModelParameters,
+    ) -> tuple[float, int]:
+        """Reserve rate limit capacity for one request, including its retries.
+
+        Returns the seconds to wait before sending and the number of tokens reserved.
+        """
+        wait = 0.0
+        tokens = 0
+        if self._request_limiter:
+            wait = self._request_limiter.reserve(1)
+        if self._token_limiter:
+            tokens = model_parameters.max_tokens + sum(
+                self._count_tokens(msg) for msg in payload
+            )
+            wait = max(wait, self._token_limiter.reserve(tokens))
+        return wait, tokens
+
+    def _release_capacity(self, reserved_tokens: int, usage: LLMUsage | None) -> None:
+        """Settle a reservation made by _reserve_capacity().
+
+        A failed request (usage None) is refunded entirely; otherwise the token
+        bucket is corrected to the tokens the request actually used.
+        """
+        if usage is None:
+            if self._request_limiter:
+                self._request_limiter.release(1)
+            if self._token_limiter:
+                self._token_limiter.release(reserved_tokens)
+        elif self._token_limiter:
+            self._token_limiter.release(
+                reserved_tokens - usage.input_tokens - usage.output_tokens
+            )
+
+    def _update_rate_limits(self, headers: Any) -> None:
+        """Lower the local token limit to the remaining tokens reported by Groq.
+
+        Groq's x-ratelimit-remaining-requests counts requests per day, not per
+        minute, so it is not applied to the per-minute request bucket.
+        """
+        remaining = headers.get("x-ratelimit-remaining-tokens")
+        if self._token_limiter and remaining:
+            with contextlib.suppress(ValueError):
+                self._token_limiter.limit(float(remaining))
+
+    def _add_to_history(
+        self, groq_messages: list[ChatCompletionMessageParam], reuse_history: bool
+    ) -> None:
+        """Append the new messages to the history, or start a new history with them."""
+        if reuse_history:
+            self.message_history.extend(groq_messages)
+        else:
+            self.message_history = groq_messages
+            self._window_start = 0
+
+    def _request_messages(
+        self, model_parameters: ModelParameters
+    ) -> list[ChatCompletionMessageParam]:
+        """Return the messages to send for the next request.
+
+        This may be message_history itself, so callers that await before sending it
+        must take a copy.
+        """
+        payload = self._windowed_history(model_parameters)
+        if model_parameters.max_history_tokens is not None:
+            payload = self._fit_token_budget(payload, model_parameters.max_history_tokens)
+        return payload
+
+    def _fit_token_budget(
+        self, payload: list[ChatCompletionMessageParam], max_tokens: int
+    ) -> list[ChatCompletionMessageParam]:
+        """Drop the oldest non-system messages until the estimated size fits max_tokens.
+
+        Leading system messages and the newest message are always kept, and so is the
+        assistant tool call of any kept tool result, even if that exceeds the budget.
+        """
+        prefix_len = 0
+        while prefix_len < len(payload) and payload[prefix_len]["role"] == "system":
+            prefix_len += 1
+        if prefix_len == len(payload):
+            return payload
+
+        budget = max_tokens - sum(self._count_tokens(msg) for msg in payload[:prefix_len])
+        start = len(payload) - 1
+        budget -= self._count_tokens(payload[start])
+        while start > prefix_len:
+            cost = self._count_tokens(payload[start - 1])
+            if cost > budget:
+                break
+            budget -= cost
+            start -= 1
+        start = _tool_group_start(payload, start, prefix_len)
+        if start == prefix_len:
+            return payload
+        return payload[:prefix_len] + payload[start:]
+
+    def _count_tokens(self, msg: ChatCompletionMessageParam) -> int:
+        """Estimate the tokens of a message at about four characters per token."""
+        cached = self._token_counts.get(id(msg))
+        if cached is not None and cached[0] is msg:
+            return cached[1]
+
+        content = msg.get("content")
+        size = len(content) if isinstance(content, str) else len(str(content or ""))
+        for tool_call in msg.get("tool_calls") or ():
+            size += len(tool_call["function"]["name"]) + len(tool_call["function"]["arguments"])
+        # A few tokens of per-message overhead for the role and separators
+        tokens = size // 4 + 4
+        if len(self._token_counts) > 4 * len(self.message_history) + 64:
+            self._token_counts.clear()
+        self._token_counts[id(msg)] = (msg, tokens)
+        return tokens
+
+    def _windowed_history(
+        self, model_parameters: ModelParameters
+    ) -> list[ChatCompletionMessageParam]:
+        """Return the part of the history to send when `recent_messages` is configured.
+
+        The window only grows between resets, so consecutive requests share the same
+        prompt prefix and keep hitting the provider's prompt cache. Once it exceeds
+        recent_messages + cache_buffer messages it is reset to the last recent_messages.
+        Leading system messages and the newest message are always kept, so a
+        recent_messages below 1 counts as 1.
+        """
+        history = self.message_history
+        if model_parameters.recent_messages is None:
+            return history
+        recent_messages = max(1, model_parameters.recent_messages)
+
+        prefix_len = 0
+        while prefix_len < len(history) and history[prefix_len]["role"] == "system":
+            prefix_len += 1
+
+        window_len = len(history) - max(self._window_start, prefix_len)
+        if window_len > recent_messages + model_parameters.cache_buffer:
+            start = max(prefix_len, len(history) - recent_messages)
+            self._window_start = _tool_group_start(history, start, prefix_len)
+
+        if self._window_start <= prefix_len:
+            return history
+        return history[:prefix_len] + history[self._window_start :]
+
+    def _build_tool_schemas(
+        self, tools: list[Tool] | None
+    ) -> list[ChatCompletionToolParam] | None:
+        """Convert tools to the Groq function tool format, reusing earlier conversions.
+
+        The schemas are sorted by tool name and the same list is returned for the same
+        tools, so the serialized tool prefix of every request is identical and can hit
+        Groq's prompt cache.
+        """
+        if not tools:
+            return None
+        key = tuple((id(tool), tool.get_name()) for tool in tools)
+        cached = self._tool_cache.get(key)
+        if cached is not None:
+            self._tool_cache.move_to_end(key)
+            return cached[1]
+
+        tool_schemas = [
+            {
+                "function": {
+                    "name": tool.get_name(),
+                    "description": tool.get_description(),
+                    "parameters": tool.get_input_schema(),
+                },
+                "type": "function",
+            }
+            for tool in sorted(tools, key=lambda tool: tool.get_name())
+        ]
+        self._tool_cache[key] = (list(tools), tool_schemas)
+        if len(self._tool_cache) > _TOOL_CACHE_SIZE:
+            _ = self._tool_cache.popitem(last=False)
+        return tool_schemas
+
+    def _completion_kwargs(
+        self,
+        payload: list[ChatCompletionMessageParam],
+        model_parameters: ModelParameters,
+        tool_schemas: list[ChatCompletionToolParam] | None,
+    ) -> dict[str, Any]:
+        """Build the keyword arguments for chat.completions.create()."""
+        return {
+            "model": model_parameters.model,
+            "messages": payload,
+            "tools": tool_schemas if tool_schemas else openai.NOT_GIVEN,
+            "temperature": model_parameters.temperature,
+            "top_p": model_parameters.top_p,
+            "max_tokens": model_parameters.max_tokens,
+            "n": 1,
+        }
+
+    def _parse_response(self, response: dict[str, Any]) -> LLMResponse:
+        """Convert a decoded Groq chat completion body into an LLMResponse.
+
+        The body is read straight from the JSON so the SDK's response models are
+        never built.
+        """
+        choice = response["choices"][0]
+        message = choice["message"]
+
+        tool_calls = None
+        if message.get("tool_calls"):
+            tool_calls: list[ToolCall] | None = []
+            for tool_call in message["tool_calls"]:
+                tool_calls.append(
+                    ToolCall(
+                        name=tool_call["function"]["name"],
+                        call_id=tool_call["id"],
+                        arguments=(
+                            _json_loads(tool_call["function"]["arguments"])
+                            if tool_call["function"].get("arguments")
+                            else {}
+                        ),
+                    )
+                )
+
+        usage = response.get("usage")
+        return LLMResponse(
+            content=message.get("content") or "",
+            tool_calls=tool_calls,
+            finish_reason=choice.get("finish_reason"),
+            model=response.get("model"),
+            usage=(
+                LLMUsage(
+                    input_tokens=usage["prompt_tokens"],
+                    output_tokens=usage["completion_tokens"],
+                )
+                if usage
+                else None
+            ),
+        )
+
+    def _add_response_to_history(self, llm_response: LLMResponse) -> None:
+        """Append the assistant turn of llm_response to the message history."""
+        if llm_response.tool_calls:
+            self.message_history.append(
+                {
+                    "role": "assistant",
+                    "content": llm_response.content,
+                    "tool_calls": [
+                        {
+                            "id": tool_call.call_id,
+                            "function": {
+                                "name": tool_call.name,
+                                "arguments": _json_dumps(tool_call.arguments),
+                            },
+                            "type": "function",
+                        }
+                        for tool_call in llm_response.tool_calls
+                    ],
+                }
+            )
+        elif llm_response.content:
+            self.message_history.append(
+                {"content": llm_response.content, "role": "assistant"}
+            )
+
+    def _record(
+        self,
+        messages: list[LLMMessage],
+        llm_response: LLMResponse,
+        model_parameters: ModelParameters,
+        tools: list[Tool] | None,
+    ) -> None:
+        """Queue the interaction for recording if a trajectory recorder is attached."""
+        if self.trajectory_recorder:
+            _record_in_background(
+                self.trajectory_recorder,
+                messages,
+                llm_response,
+                model_parameters.model,
+                tools,
+            )
+
+
+    @override
+    def supports_tool_calling(self, model_parameters: ModelParameters) -> bool:
+        """Check if the current model supports tool calling."""
+        return _supports_tool_calling(model_parameters.model)
+
+    
+    def parse_messages(
+        self, messages: list[LLMMessage]
+    ) -> list[ChatCompletionMessageParam]:
+        return [self._parse_cached(msg) for msg in messages]
+
+    def _parse_cached(self, msg: LLMMessage) -> ChatCompletionMessageParam:
+        """Parse msg, reusing the result for a message with the same content."""
+        key = _message_key(msg)
+        if key is None:
+            return _parse_message(msg)
+        parsed = self._parse_cache.get(key)
+        if parsed is not None:
+            self._parse_cache.move_to_end(key)
+            return parsed
+
+        parsed = _parse_message(msg)
+        self._parse_cache[key] = parsed
+        if len(self._parse_cache) > _PARSE_CACHE_SIZE:
+            _ = self._parse_cache.popitem(last=False)
+        return parsed
@@ -94,6 +94,13 @@ class LakeView:
             max_retries=model_parameters.max_retries,
             base_url=model_parameters.base_url,
             api_version=model_parameters.api_version,
+            retry_base_delay=model_parameters.retry_base_delay,
+            retry_max_delay=model_parameters.retry_max_delay,
+            recent_messages=model_parameters.recent_messages,
+            cache_buffer=model_parameters.cache_buffer,
+            max_history_tokens=model_parameters.max_history_tokens,
+            requests_per_minute=model_parameters.requests_per_minute,
+            tokens_per_minute=model_parameters.tokens_per_minute,
         )
         self.lakeview_llm_client: LLMClient = LLMClient(
             config.lakeview_config.model_provider, self.model_parameters
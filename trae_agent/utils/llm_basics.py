@@ -17,7 +17,7 @@ class LLMMessage:
     tool_result: ToolResult | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class LLMUsage:
     """LLM usage format."""
 
@@ -43,7 +43,7 @@ class LLMUsage:
         return f"LLMUsage(input_tokens={self.input_tokens}, output_tokens={self.output_tokens}, cache_creation_input_tokens={self.cache_creation_input_tokens}, cache_read_input_tokens={self.cache_read_input_tokens}, reasoning_tokens={self.reasoning_tokens})"
 
 
-@dataclass
+@dataclass(slots=True)
 class LLMResponse:
     """Standard LLM response format."""
 
@@ -9,6 +9,7 @@
 """Trajectory recording functionality for Trae Agent."""
 
 import json
+import threading
 from datetime import datetime
 from pathlib import Path
 from typing import Any
@@ -45,6 +46,8 @@ class TrajectoryRecorder:
             "execution_time": 0.0,
         }
         self._start_time: datetime | None = None
+        # LLM clients may record from a background thread
+        self._save_lock: threading.Lock = threading.Lock()
 
     def start_recording(
         self, task: str, provider: str, model: str, max_steps: int
@@ -227,7 +230,7 @@ class TrajectoryRecorder:
             # Ensure directory exists
             self.trajectory_path.parent.mkdir(parents=True, exist_ok=True)
 
-            with open(self.trajectory_path, "w", encoding="utf-8") as f:
+            with self._save_lock, open(self.trajectory_path, "w", encoding="utf-8") as f:
                 json.dump(self.trajectory_data, f, indent=2, ensure_ascii=False)
 
         except Exception as e: